@@ -1,12 +1,24 @@
 import asyncio
-
-from . import server
+import importlib
 
 
 def main():
     """Main entry point for the package."""
+    from . import server
+
     asyncio.run(server.main())
 
 
+def __getattr__(name: str):
+    """Import the server module on first access.
+
+    Importing it sets up the MCP server and the indices directory, which
+    the CLI does not need.
+    """
+    if name == "server":
+        return importlib.import_module(f"{__name__}.server")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 # Optionally expose other important items at package level
 __all__ = ["main", "server"]
@@ -1,11 +1,13 @@
 import asyncio
 import sys
 from pathlib import Path
+from typing import Dict, List, Optional
 
 import click
 from rich.console import Console
 
 from .embeddings import EmbeddingService
+from .utils import format_lines, join_chunks
 from .vector_store import InMemoryVectorStore
 
 console = Console()
@@ -32,9 +34,12 @@ def index(repo_path: Path):
 
 async def _index_repository(repo_path: Path):
     """Index a repository asynchronously."""
-    from .server import update_index
+    from .server import embedding_service, update_index
 
-    await update_index(repo_path)
+    try:
+        await update_index(repo_path)
+    finally:
+        await embedding_service.aclose()
 
 
 @cli.command()
@@ -44,12 +49,27 @@ async def _index_repository(repo_path: Path):
     "--file-mode/--no-file-mode", default=False, help="Search for files by path"
 )
 @click.option("--repository", help="Specific repository to search in")
-def search(query: str, num_results: int, file_mode: bool, repository: str = None):
+@click.option("--exact", is_flag=True, help="Scan every vector, even in large indexes")
+@click.option(
+    "--nprobe",
+    type=click.IntRange(min=1),
+    help="Partitions scanned by approximate searches of large indexes",
+)
+def search(
+    query: str,
+    num_results: int,
+    file_mode: bool,
+    repository: str = None,
+    exact: bool = False,
+    nprobe: Optional[int] = None,
+):
     """Search through indexed code repositories."""
     try:
         if num_results < 1:
             raise click.BadParameter("Number of results must be positive")
-        asyncio.run(_search_code(query, num_results, file_mode, repository))
+        asyncio.run(
+            _search_code(query, num_results, file_mode, repository, exact, nprobe)
+        )
     except click.BadParameter as e:
         console.print(f"[red]Error: {str(e)}[/red]")
         sys.exit(2)
@@ -59,7 +79,12 @@ def search(query: str, num_results: int, file_mode: bool, repository: str = None
 
 
 async def _search_code(
-    query: str, num_results: int, file_mode: bool, repository: str = None
+    query: str,
+    num_results: int,
+    file_mode: bool,
+    repository: str = None,
+    exact: bool = False,
+    nprobe: Optional[int] = None,
 ):
     """Search code asynchronously."""
     indices_dir = Path("indices")
@@ -78,46 +103,54 @@ async def _search_code(
 
     console.print(f"Found {len(indices)} indexed repositories.")
     embedding_service = EmbeddingService()
+    query_embedding = None
 
-    for idx_path in indices:
-        repo_name = idx_path.stem
-        console.print(f"Searching in {repo_name}...")
-
-        store = InMemoryVectorStore(pickle_path=str(idx_path))
-
-        if file_mode:
-            # File path search
-            matches = []
-            for metadata in store.metadata:
-                if query.lower() in metadata["file"].lower():
-                    matches.append(metadata)
-
-            if not matches:
-                console.print("No matching files found.")
-                continue
-
-            console.print("Search Results:\n")
-            for match in matches[:num_results]:
-                console.print(f"File: {match['file']}")
-                console.print(f"Repository: {match['repo']}")
-                console.print(
-                    f"Code:\n```{match.get('language', '')}\n{match['code']}\n```\n"
-                )
-
-        else:
-            # Semantic search
-            query_embedding = await embedding_service.get_embedding(query)
-            results = store.search(query_embedding, top_k=num_results)
-
-            if not results:
-                console.print("No matches found.")
-                return
-
-            console.print("Search Results:\n")
-            for metadata, score in results:
-                console.print(f"File: {metadata['file']}")
-                console.print(f"Repository: {metadata['repo']}")
-                console.print(f"Score: {score:.2f}")
-                console.print(
-                    f"Code:\n```{metadata.get('language', '')}\n{metadata['code']}\n```\n"
-                )
+    try:
+        for idx_path in indices:
+            repo_name = idx_path.stem
+            console.print(f"Searching in {repo_name}...")
+
+            store = InMemoryVectorStore(
+                pickle_path=str(idx_path), approximate=not exact, nprobe=nprobe
+            )
+
+            if file_mode:
+                # File path search, showing each file once rebuilt from its chunks
+                matches: Dict[str, List[Dict]] = {}
+                for metadata in store.metadata:
+                    if query.lower() in metadata["file"].lower():
+                        matches.setdefault(metadata["file"], []).append(metadata)
+
+                if not matches:
+                    console.print("No matching files found.")
+                    continue
+
+                console.print("Search Results:\n")
+                for chunks in list(matches.values())[:num_results]:
+                    match = chunks[0]
+                    console.print(f"File: {match['file']}")
+                    console.print(f"Repository: {match['repo']}")
+                    console.print(
+                        f"Code:\n```{match.get('language', '')}\n{join_chunks(chunks)}\n```\n"
+                    )
+
+            else:
+                # Semantic search, embedding the query only once for all repositories
+                if query_embedding is None:
+                    query_embedding = await embedding_service.get_embedding(query)
+                results = store.search(query_embedding, top_k=num_results)
+
+                if not results:
+                    console.print("No matches found.")
+                    return
+
+                console.print("Search Results:\n")
+                for metadata, score in results:
+                    console.print(f"File: {metadata['file']}{format_lines(metadata)}")
+                    console.print(f"Repository: {metadata['repo']}")
+                    console.print(f"Score: {score:.2f}")
+                    console.print(
+                        f"Code:\n```{metadata.get('language', '')}\n{metadata['code']}\n```\n"
+                    )
+    finally:
+        await embedding_service.aclose()
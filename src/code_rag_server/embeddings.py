@@ -1,23 +1,80 @@
-from typing import List, Union
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 import httpx
 import numpy as np
 from rich.console import Console
+from rich.progress import Progress
 
 console = Console()
 
+# Single texts requested while another request is outstanding are embedded
+# together once this many seconds have passed, up to the given number of texts
+_MICRO_BATCH_WAIT = 0.005
+_MICRO_BATCH_SIZE = 32
+
 
 class EmbeddingService:
-    def __init__(self, api_url: str = "http://127.0.0.1:1235/v1/embeddings"):
-        """Initialize the embedding service with the LLM Studio API endpoint."""
+    def __init__(
+        self,
+        api_url: str = "http://127.0.0.1:1235/v1/embeddings",
+        max_concurrent: int = 8,
+        max_cache_entries: int = 4096,
+    ):
+        """Initialize the embedding service with the LLM Studio API endpoint.
+
+        ``max_concurrent`` bounds the number of batch requests that
+        ``get_batch_embeddings`` keeps in flight. Embeddings of the last
+        ``max_cache_entries`` distinct texts are kept, so repeated texts are
+        not sent to the API again.
+        """
         self.api_url = api_url
         self.model = "text-embedding-nomic-embed-text-v1.5@q8_0"
+        self.max_concurrent = max_concurrent
+        self.max_cache_entries = max_cache_entries
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # Least recently used embeddings, keyed by a hash of their text
+        self._cache: OrderedDict[bytes, np.ndarray] = OrderedDict()
+
+        # Single texts waiting to be sent together, and the event loop they
+        # were queued on
+        self._pending: List[Tuple[str, asyncio.Future[np.ndarray]]] = []
+        self._pending_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks: Set[asyncio.Task] = set()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Return the shared HTTP client, creating it on first use.
+
+        Reusing one client keeps connections to the API alive between requests.
+        Large batches can take a while to embed, so reads get a generous
+        timeout while connecting to the local server should be quick.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(60.0, connect=5.0),
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the shared HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     async def get_embedding(
         self, text: Union[str, List[str]]
     ) -> Union[np.ndarray, List[np.ndarray]]:
         """Get embeddings for a single text or list of texts.
 
+        Single texts requested concurrently are coalesced into one request,
+        and single texts embedded before are served from the cache.
+
         Args:
             text: Single string or list of strings to embed
 
@@ -39,17 +96,14 @@ class EmbeddingService:
             else:
                 texts = [text]
 
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.api_url,
-                    json={"model": self.model, "input": texts},
-                    timeout=30.0,
-                )
-                response.raise_for_status()
-                data = response.json()
-
-                embeddings = [np.array(item["embedding"]) for item in data["data"]]
-                return embeddings[0] if isinstance(text, str) else embeddings
+            if isinstance(text, str):
+                key = _text_key(text)
+                embedding = self._cache_get(key)
+                if embedding is None:
+                    embedding = await self._queue_single(text)
+                    self._cache_put(key, embedding)
+                return embedding
+            return await self._post(texts)
 
         except httpx.HTTPError as e:
             console.print(f"[red]Error getting embeddings: {str(e)}[/red]")
@@ -58,36 +112,176 @@ class EmbeddingService:
             console.print(f"[red]Unexpected error: {str(e)}[/red]")
             raise
 
+    async def _post(self, texts: List[str]) -> List[np.ndarray]:
+        """Send one embedding request for texts and parse the vectors."""
+        response = await self.client.post(
+            self.api_url,
+            json={"model": self.model, "input": texts},
+        )
+        response.raise_for_status()
+        data = response.json()
+        return [np.array(item["embedding"]) for item in data["data"]]
+
+    def _cache_get(self, key: bytes) -> Optional[np.ndarray]:
+        """Return the cached embedding for key, marking it as recently used."""
+        embedding = self._cache.get(key)
+        if embedding is not None:
+            self._cache.move_to_end(key)
+        return embedding
+
+    def _cache_put(self, key: bytes, embedding: np.ndarray) -> None:
+        """Cache an embedding, evicting the least recently used ones."""
+        # Cached vectors are handed out to every caller, so guard them
+        embedding.flags.writeable = False
+        self._cache[key] = embedding
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_cache_entries:
+            self._cache.popitem(last=False)
+
+    def _queue_single(self, text: str) -> asyncio.Future[np.ndarray]:
+        """Queue a single text for the next coalesced request."""
+        loop = asyncio.get_running_loop()
+        if self._pending_loop is not loop:
+            # Texts queued on another event loop can no longer be answered
+            self._pending = []
+            self._flush_handle = None
+            self._flush_tasks = set()
+            self._pending_loop = loop
+
+        # A lone caller is sent right away; only callers arriving while
+        # another request is outstanding wait to be batched
+        idle = not self._pending and not self._flush_tasks
+        future: asyncio.Future[np.ndarray] = loop.create_future()
+        self._pending.append((text, future))
+        if idle or len(self._pending) >= _MICRO_BATCH_SIZE:
+            self._flush_pending()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(_MICRO_BATCH_WAIT, self._flush_pending)
+        return future
+
+    def _flush_pending(self) -> None:
+        """Send the queued single texts in one request."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        # Skip callers that were cancelled while waiting
+        batch = [(text, future) for text, future in self._pending if not future.done()]
+        self._pending = []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._post_pending(batch))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+    async def _post_pending(
+        self, batch: List[Tuple[str, asyncio.Future[np.ndarray]]]
+    ) -> None:
+        """Embed a batch of queued texts and hand each caller its vector."""
+        try:
+            embeddings = await self._post([text for text, _ in batch])
+            if len(embeddings) != len(batch):
+                raise ValueError(
+                    f"Expected {len(batch)} embeddings, got {len(embeddings)}"
+                )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), embedding in zip(batch, embeddings, strict=True):
+            if not future.done():
+                future.set_result(embedding)
+
     async def get_batch_embeddings(
-        self, texts: List[str], batch_size: int = 32
-    ) -> List[np.ndarray]:
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        max_concurrency: Optional[int] = None,
+        max_chars: int = 32_000,
+        show_progress: bool = True,
+    ) -> np.ndarray:
         """Get embeddings for a list of texts in batches.
 
+        Only texts that are not cached are sent, each distinct text once.
+        Texts are grouped by length so each batch holds similarly sized inputs,
+        which keeps padding on the embedding server low. A batch is closed once
+        it holds ``batch_size`` texts or adding the next text would exceed
+        ``max_chars`` characters, so batches of long texts hold fewer of them
+        and requests take similar time. Batches are sent
+        concurrently, with at most ``max_concurrency`` requests in flight
+        (``max_concurrent`` of the service by default).
+
         Args:
             texts: List of texts to embed
             batch_size: Maximum number of texts per batch
+            max_concurrency: Maximum number of concurrent batch requests,
+                overriding ``max_concurrent``
+            max_chars: Maximum total characters per batch, unless a single
+                text is longer
+            show_progress: Whether to show a progress bar, which callers
+                reporting their own progress can turn off
 
         Returns:
-            List of embedding vectors
+            Float32 array with one embedding per row, in the same order as
+            ``texts``
         """
-        all_embeddings = []
-
         # Validate input
         if not texts:
             raise ValueError("Empty input")
 
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i : i + batch_size]
-            batch_embeddings = await self.get_embedding(batch)
-            all_embeddings.extend(
-                batch_embeddings
-                if isinstance(batch_embeddings, list)
-                else [batch_embeddings]
-            )
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrent)
+
+        keys = [_text_key(text) for text in texts]
+        embeddings: Dict[bytes, np.ndarray] = {}
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts, strict=True):
+            cached = self._cache_get(key)
+            if cached is not None:
+                embeddings[key] = cached
+            else:
+                missing.setdefault(key, text)
+
+        missing_keys = sorted(missing, key=lambda key: len(missing[key]))
+        batches: List[List[bytes]] = []
+        batch_chars = 0
+        for key in missing_keys:
+            chars = len(missing[key])
+            if (
+                not batches
+                or len(batches[-1]) >= batch_size
+                or batch_chars + chars > max_chars
+            ):
+                batches.append([])
+                batch_chars = 0
+            batches[-1].append(key)
+            batch_chars += chars
+
+        # Report progress through a bar, which redraws at a limited rate
+        # instead of writing a line per batch
+        with Progress(console=console, disable=not show_progress) as progress:
+            task = progress.add_task("Embedding texts", total=len(missing_keys))
+
+            async def embed_batch(batch: List[bytes]) -> None:
+                async with semaphore:
+                    batch_embeddings = await self.get_embedding(
+                        [missing[key] for key in batch]
+                    )
+                if len(batch_embeddings) != len(batch):
+                    raise ValueError(
+                        f"Expected {len(batch)} embeddings, got {len(batch_embeddings)}"
+                    )
+                for key, embedding in zip(batch, batch_embeddings, strict=True):
+                    embeddings[key] = embedding
+                    self._cache_put(key, embedding)
+                progress.advance(task, len(batch))
+
+            await asyncio.gather(*(embed_batch(batch) for batch in batches))
+
+        # Restore the input order
+        return np.array([embeddings[key] for key in keys], dtype=np.float32)
 
-            # Log progress
-            console.print(
-                f"[green]Processed {min(i + batch_size, len(texts))}/{len(texts)} texts[/green]"
-            )
 
-        return all_embeddings
+def _text_key(text: str) -> bytes:
+    """Return the cache key of a text."""
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
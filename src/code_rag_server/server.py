@@ -1,16 +1,22 @@
+import asyncio
+import heapq
+import os
 import re
 import subprocess
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 import mcp.server.stdio
 import mcp.types as types
+import numpy as np
 from mcp.server import NotificationOptions, Server
 from mcp.server.models import InitializationOptions
 from rich.console import Console
-from tqdm import tqdm
+from rich.progress import Progress
 
 from .embeddings import EmbeddingService
+from .utils import format_lines, join_chunks
 from .vector_store import InMemoryVectorStore
 
 # Initialize components
@@ -23,6 +29,83 @@ indices_dir = Path("indices")
 indices_dir.mkdir(parents=True, exist_ok=True)
 vector_store: Optional[InMemoryVectorStore] = None
 
+# Searches score the exact float32 embeddings unless quantized scoring is
+# enabled, e.g. with CODE_RAG_QUANTIZATION=int8
+store_quantization: Optional[str] = os.environ.get("CODE_RAG_QUANTIZATION") or None
+
+# Large stores are searched approximately unless CODE_RAG_APPROXIMATE=0.
+# CODE_RAG_NPROBE sets how many k-means partitions such searches scan.
+store_approximate = os.environ.get("CODE_RAG_APPROXIMATE", "1") != "0"
+store_nprobe: Optional[int] = (
+    int(os.environ["CODE_RAG_NPROBE"]) if "CODE_RAG_NPROBE" in os.environ else None
+)
+
+# Files are embedded as overlapping windows of whole lines
+_CHUNK_MAX_LINES = 60
+_CHUNK_MAX_CHARS = 2000
+_CHUNK_OVERLAP_LINES = 10
+
+# Maximum number of files read concurrently while indexing
+_MAX_CONCURRENT_READS = 32
+
+# Distinct chunks are sent for embedding in groups of this size while the
+# remaining files are still being read
+_EMBED_GROUP_SIZE = 256
+
+# Files inside these directories (or with these names) are never indexed
+_DIR_IGNORES = {".git", "__pycache__", "node_modules", "venv", ".env"}
+
+# Binary file types that are never indexed
+_SUFFIX_IGNORES = {
+    ".pyc",
+    ".pyo",
+    ".pyd",
+    ".so",
+    ".dll",
+    ".dylib",
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".gif",
+    ".pdf",
+    ".zip",
+}
+
+# Matches paths with an ignored directory component or binary suffix, so a
+# path is checked with a single regex search
+_IGNORE_RE = re.compile(
+    r"(?:^|/)(?:{dirs})(?:/|$)|[^/]\.(?i:{suffixes})$".format(
+        dirs="|".join(map(re.escape, sorted(_DIR_IGNORES))),
+        suffixes="|".join(re.escape(suffix[1:]) for suffix in sorted(_SUFFIX_IGNORES)),
+    )
+)
+
+# Languages recorded in chunk metadata, by file extension
+_EXT_LANG = {
+    ".py": "python",
+    ".js": "javascript",
+    ".ts": "typescript",
+    ".java": "java",
+    ".cpp": "cpp",
+    ".c": "c",
+    ".go": "go",
+    ".rs": "rust",
+    ".rb": "ruby",
+    ".php": "php",
+    ".cs": "csharp",
+    ".html": "html",
+    ".css": "css",
+    ".sql": "sql",
+}
+
+# Larger files are skipped, as are files with a NUL byte in their first block
+_MAX_FILE_SIZE = 1024 * 1024
+_BINARY_SNIFF_SIZE = 8192
+
+# Accepted GitHub repository URL formats
+_HTTPS_RE = re.compile(r"https://github\.com/([^/]+)/([^/]+?)(?:\.git)?/?$")
+_SSH_RE = re.compile(r"git@github\.com:([^/]+)/([^/]+?)(?:\.git)?/?$")
+
 
 @server.list_tools()
 async def handle_list_tools() -> list[types.Tool]:
@@ -117,7 +200,10 @@ async def handle_call_tool(
         branch = arguments.get("branch")
 
         try:
-            repo_path = _clone_github_repo(repository_url, branch)
+            # Clone in a worker thread, so other requests are served meanwhile
+            repo_path = await asyncio.to_thread(
+                _clone_github_repo, repository_url, branch
+            )
             relative_path = repo_path.relative_to(Path("github_repos"))
 
             return [
@@ -157,26 +243,29 @@ async def handle_call_tool(
                 )
             ]
 
-        # Load vector stores and search
-        all_results = []
-        for pickle_file in pickle_files:
-            store = InMemoryVectorStore(pickle_path=str(pickle_file))
-            if store.size > 0:
-                query_embedding = await embedding_service.get_embedding(query)
-                results = store.search(query_embedding, top_k=num_results)
-                all_results.extend(results)
+        # Embed the query once and search every vector store with it. Stores are
+        # loaded and searched concurrently in worker threads.
+        query_embedding = await embedding_service.get_embedding(query)
+
+        async def search_store(pickle_file: Path) -> List[Tuple[Dict, float]]:
+            store = await asyncio.to_thread(_load_store, pickle_file)
+            if store.size == 0:
+                return []
+            return await asyncio.to_thread(store.search, query_embedding, num_results)
+
+        store_results = await asyncio.gather(*map(search_store, pickle_files))
+        all_results = [result for results in store_results for result in results]
 
         if not all_results:
             return [types.TextContent(type="text", text="No matches found.")]
 
-        # Sort results by score and format output
-        all_results.sort(key=lambda x: x[1], reverse=True)
-        all_results = all_results[:num_results]
+        # Keep the best results across all repositories and format output
+        all_results = heapq.nlargest(num_results, all_results, key=lambda x: x[1])
 
         formatted_results = []
         for metadata, score in all_results:
             formatted_results.append(
-                f"File: {metadata['file']}\n"
+                f"File: {metadata['file']}{format_lines(metadata)}\n"
                 f"Repository: {metadata['repo']}\n"
                 f"Score: {score:.2f}\n"
                 f"Code:\n```{metadata.get('language', '')}\n{metadata['code']}\n```\n"
@@ -197,17 +286,18 @@ async def handle_call_tool(
                 )
             ]
 
-        store = InMemoryVectorStore(pickle_path=str(pickle_file))
-        for metadata in store.metadata:
-            if metadata["file"] == file_path:
-                return [
-                    types.TextContent(
-                        type="text",
-                        text=f"File: {metadata['file']}\n"
-                        f"Repository: {metadata['repo']}\n"
-                        f"Code:\n```{metadata.get('language', '')}\n{metadata['code']}\n```",
-                    )
-                ]
+        store = await asyncio.to_thread(_load_store, pickle_file)
+        chunks = [m for m in store.metadata if m["file"] == file_path]
+        if chunks:
+            metadata = chunks[0]
+            return [
+                types.TextContent(
+                    type="text",
+                    text=f"File: {metadata['file']}\n"
+                    f"Repository: {metadata['repo']}\n"
+                    f"Code:\n```{metadata.get('language', '')}\n{join_chunks(chunks)}\n```",
+                )
+            ]
 
         return [
             types.TextContent(
@@ -237,40 +327,98 @@ async def update_index(repo_path: Path) -> List[types.TextContent]:
     pickle_file.parent.mkdir(parents=True, exist_ok=True)
     store = InMemoryVectorStore(pickle_path=str(pickle_file))
 
-    # Process files
-    indexed_files = 0
-    file_contents = []
-    file_metadata = []
-
     console.print("[green]Starting indexing process...[/green]")
-    for file_path in tqdm(list(repo_path.rglob("*")), desc="Scanning files"):
-        if file_path.is_file() and not _should_ignore(file_path):
+    file_paths = list(_iter_files(repo_path))
+
+    # Read and chunk files in worker threads, so the event loop is not blocked
+    semaphore = asyncio.Semaphore(_MAX_CONCURRENT_READS)
+
+    async def read_file(
+        index: int, file_path: Path
+    ) -> Tuple[int, Union[Optional[List[Tuple[str, Dict]]], Exception]]:
+        async with semaphore:
             try:
-                content = file_path.read_text()
-                file_contents.append(content)
-                file_metadata.append(
-                    {
-                        "file": str(file_path.relative_to(repo_path)),
-                        "repo": str(relative_path),
-                        "code": content,
-                        "language": _guess_language(file_path),
-                    }
+                chunks = await asyncio.to_thread(
+                    _read_chunks, file_path, repo_path, relative_path
                 )
-                indexed_files += 1
             except Exception as e:
-                console.print(f"[red]Error processing {file_path}: {str(e)}[/red]")
-
-    if file_contents:
-        console.print(
-            f"[green]Generating embeddings for {len(file_contents)} files...[/green]"
-        )
-        embeddings = await embedding_service.get_batch_embeddings(file_contents)
-
+                return index, e
+        return index, chunks
+
+    # Embed chunks while files are still being read. Identical chunks
+    # (vendored or generated files, license headers) are embedded only once,
+    # in order of first appearance.
+    unique_chunks: Dict[str, int] = {}
+    groups: asyncio.Queue[Optional[List[str]]] = asyncio.Queue()
+
+    # One bar covers all groups; its total grows as chunks are found
+    progress = Progress(console=console)
+    progress_task = progress.add_task("Embedding chunks", total=0)
+
+    async def embed_groups() -> List[np.ndarray]:
+        embedded = []
+        while (group := await groups.get()) is not None:
+            embeddings = await embedding_service.get_batch_embeddings(
+                group, show_progress=False
+            )
+            embedded.append(np.asarray(embeddings, dtype=np.float32))
+            progress.advance(progress_task, len(group))
+        return embedded
+
+    def queue_group(group: List[str]) -> None:
+        groups.put_nowait(group)
+        progress.update(progress_task, total=len(unique_chunks))
+
+    console.print(f"[green]Reading and embedding {len(file_paths)} files...[/green]")
+    file_chunks: List[Optional[List[Tuple[str, Dict]]]] = [None] * len(file_paths)
+    group: List[str] = []
+    with progress:
+        embed_task = asyncio.create_task(embed_groups())
+        try:
+            reads = [read_file(i, path) for i, path in enumerate(file_paths)]
+            for next_read in asyncio.as_completed(reads):
+                index, chunks = await next_read
+                if isinstance(chunks, Exception):
+                    console.print(
+                        f"[red]Error processing {file_paths[index]}: {str(chunks)}[/red]"
+                    )
+                    continue
+                file_chunks[index] = chunks
+
+                for chunk, _ in chunks or []:
+                    if chunk not in unique_chunks:
+                        unique_chunks[chunk] = len(unique_chunks)
+                        group.append(chunk)
+                if len(group) >= _EMBED_GROUP_SIZE:
+                    queue_group(group)
+                    group = []
+        except BaseException:
+            embed_task.cancel()
+            raise
+        if group:
+            queue_group(group)
+        groups.put_nowait(None)
+        embedded = await embed_task
+
+    # Store chunks in file order, each with the embedding of its text
+    indexed_files = 0
+    positions = []
+    chunk_metadata = []
+    for chunks in file_chunks:
+        if chunks is None:
+            continue
+        for chunk, metadata in chunks:
+            positions.append(unique_chunks[chunk])
+            chunk_metadata.append(metadata)
+        indexed_files += 1
+
+    if chunk_metadata:
         console.print("[green]Storing embeddings...[/green]")
-        for embedding, metadata in tqdm(
-            zip(embeddings, file_metadata, strict=False), desc="Storing embeddings"
-        ):
-            store.add(embedding, metadata)
+        # Saving can build an ANN index or partitions, which takes a while
+        # for large repositories, so keep it off the event loop
+        await asyncio.to_thread(
+            store.add_many, np.concatenate(embedded)[positions], chunk_metadata
+        )
 
         return [
             types.TextContent(
@@ -284,37 +432,144 @@ async def update_index(repo_path: Path) -> List[types.TextContent]:
         ]
 
 
-def _should_ignore(path: Path) -> bool:
-    """Check if a file should be ignored."""
-    ignore_patterns = {
-        ".git",
-        "__pycache__",
-        "node_modules",
-        "venv",
-        ".env",
-        ".pyc",
-        ".pyo",
-        ".pyd",
-        ".so",
-        ".dll",
-        ".dylib",
-        ".jpg",
-        ".jpeg",
-        ".png",
-        ".gif",
-        ".pdf",
-        ".zip",
-    }
-    return any(part in ignore_patterns for part in path.parts)
+def _chunk_file(content: str) -> List[Tuple[str, int, int]]:
+    """Split file content into overlapping chunks of whole lines.
+
+    Returns ``(text, start_line, end_line)`` tuples with 1-based, inclusive
+    line numbers. Together the chunks cover every line, so the file can be
+    rebuilt from them. Windows holding only whitespace are not chunks of
+    their own but extend the chunk before them, or the first chunk if they
+    lead the file.
+    """
+    lines = content.splitlines(keepends=True)
+    spans: List[List[int]] = []
+    start = 0
+    prev_end = 0
+    while start < len(lines):
+        end = _chunk_end(lines, start)
+        if end <= prev_end:
+            # The overlap left no room for a new line before a long one, so
+            # continue after the previous chunk instead of repeating part of it
+            start = prev_end
+            end = _chunk_end(lines, start)
+
+        if any(line.strip() for line in lines[start:end]):
+            spans.append([start if spans else 0, end])
+        elif spans:
+            spans[-1][1] = end
+        if end == len(lines):
+            break
+        prev_end = end
+        start = end - min(_CHUNK_OVERLAP_LINES, (end - start) // 4)
+    return [("".join(lines[start:end]), start + 1, end) for start, end in spans]
+
+
+def _chunk_end(lines: List[str], start: int) -> int:
+    """Return the end of the chunk starting at start, taking at least one line."""
+    end = start + 1
+    chars = len(lines[start])
+    while (
+        end < len(lines)
+        and end - start < _CHUNK_MAX_LINES
+        and chars + len(lines[end]) <= _CHUNK_MAX_CHARS
+    ):
+        chars += len(lines[end])
+        end += 1
+    return end
+
+
+def _load_store(pickle_file: Path) -> InMemoryVectorStore:
+    """Load the vector store saved at pickle_file, using the store cache."""
+    return _get_store(str(pickle_file), os.path.getmtime(pickle_file))
+
+
+@lru_cache(maxsize=8)
+def _get_store(pickle_path: str, mtime: float) -> InMemoryVectorStore:
+    """Load a vector store, reusing it until its index file changes.
+
+    Callers pass the index file's modification time so that re-indexing a
+    repository invalidates the cached store. Stores are searched with the
+    ``store_quantization``, ``store_approximate`` and ``store_nprobe`` settings.
+    """
+    return InMemoryVectorStore(
+        pickle_path=pickle_path,
+        quantization=store_quantization,
+        approximate=store_approximate,
+        nprobe=store_nprobe,
+    )
+
+
+def _should_ignore(path: str) -> bool:
+    """Check if a file should be ignored, given its POSIX path or just its name."""
+    return _IGNORE_RE.search(path) is not None
+
+
+def _iter_files(root: Path) -> Iterator[Path]:
+    """Yield the files below root that should be indexed.
+
+    Ignored directories are pruned during the walk, so their contents are
+    never listed.
+    """
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = [name for name in dir_names if name not in _DIR_IGNORES]
+        for file_name in file_names:
+            # Match the name directly rather than building a Path per file
+            if not _should_ignore(file_name):
+                yield Path(dir_path, file_name)
+
+
+def _read_source(path: Path) -> Optional[str]:
+    """Read a text file for indexing.
+
+    Returns None for files that are too large or look binary. Raises if the
+    file cannot be read or is not valid UTF-8.
+    """
+    if path.stat().st_size > _MAX_FILE_SIZE:
+        return None
+    data = path.read_bytes()
+    if _looks_binary(data):
+        return None
+    return data.decode("utf-8")
+
+
+def _read_chunks(
+    path: Path, repo_path: Path, relative_path: Path
+) -> Optional[List[Tuple[str, Dict]]]:
+    """Read a file and split it into chunks ready for embedding.
+
+    Returns ``(text, metadata)`` pairs, or None if the file is skipped.
+    """
+    content = _read_source(path)
+    if content is None:
+        return None
+
+    file = str(path.relative_to(repo_path))
+    language = _guess_language(path)
+    return [
+        (
+            chunk,
+            {
+                "file": file,
+                "repo": str(relative_path),
+                "code": chunk,
+                "language": language,
+                "start_line": start_line,
+                "end_line": end_line,
+            },
+        )
+        for chunk, start_line, end_line in _chunk_file(content)
+    ]
+
+
+def _looks_binary(data: bytes) -> bool:
+    """Check whether file content looks binary, i.e. has a NUL byte early on."""
+    return b"\x00" in data[:_BINARY_SNIFF_SIZE]
 
 
 def _validate_github_url(url: str) -> Tuple[str, str]:
     """Validate GitHub URL and extract owner/repo."""
-    https_pattern = r"https://github\.com/([^/]+)/([^/]+?)(?:\.git)?/?$"
-    ssh_pattern = r"git@github\.com:([^/]+)/([^/]+?)(?:\.git)?/?$"
-
-    https_match = re.match(https_pattern, url)
-    ssh_match = re.match(ssh_pattern, url)
+    https_match = _HTTPS_RE.match(url)
+    ssh_match = _SSH_RE.match(url)
 
     if https_match:
         return https_match.groups()
@@ -329,7 +584,11 @@ def _validate_github_url(url: str) -> Tuple[str, str]:
 
 
 def _clone_github_repo(url: str, branch: Optional[str] = None) -> Path:
-    """Clone a GitHub repository."""
+    """Clone a GitHub repository.
+
+    Only the latest commit of a single branch is fetched, since indexing needs
+    nothing from the history.
+    """
     owner, repo = _validate_github_url(url)
 
     base_path = Path("github_repos")
@@ -340,7 +599,7 @@ def _clone_github_repo(url: str, branch: Optional[str] = None) -> Path:
 
     repo_path.parent.mkdir(parents=True, exist_ok=True)
 
-    cmd = ["git", "clone"]
+    cmd = ["git", "clone", "--depth=1", "--single-branch"]
     if branch:
         cmd.extend(["-b", branch])
     cmd.extend([url, str(repo_path)])
@@ -352,36 +611,23 @@ def _clone_github_repo(url: str, branch: Optional[str] = None) -> Path:
 
 def _guess_language(path: Path) -> str:
     """Guess programming language from file extension."""
-    ext_to_lang = {
-        ".py": "python",
-        ".js": "javascript",
-        ".ts": "typescript",
-        ".java": "java",
-        ".cpp": "cpp",
-        ".c": "c",
-        ".go": "go",
-        ".rs": "rust",
-        ".rb": "ruby",
-        ".php": "php",
-        ".cs": "csharp",
-        ".html": "html",
-        ".css": "css",
-        ".sql": "sql",
-    }
-    return ext_to_lang.get(path.suffix.lower(), "")
+    return _EXT_LANG.get(path.suffix.lower(), "")
 
 
 async def main():
     async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name="code-rag-server",
-                server_version="0.1.0",
-                capabilities=server.get_capabilities(
-                    notification_options=NotificationOptions(),
-                    experimental_capabilities={},
+        try:
+            await server.run(
+                read_stream,
+                write_stream,
+                InitializationOptions(
+                    server_name="code-rag-server",
+                    server_version="0.1.0",
+                    capabilities=server.get_capabilities(
+                        notification_options=NotificationOptions(),
+                        experimental_capabilities={},
+                    ),
                 ),
-            ),
-        )
+            )
+        finally:
+            await embedding_service.aclose()
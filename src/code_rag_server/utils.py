@@ -0,0 +1,20 @@
+from typing import Dict, List
+
+
+def format_lines(metadata: Dict) -> str:
+    """Format the line range of a chunk for display, if it is known."""
+    if "start_line" not in metadata:
+        return ""
+    return f" (lines {metadata['start_line']}-{metadata['end_line']})"
+
+
+def join_chunks(chunks: List[Dict]) -> str:
+    """Reassemble file content from the metadata of its overlapping chunks."""
+    lines: List[str] = []
+    for chunk in sorted(chunks, key=lambda m: m.get("start_line", 1)):
+        chunk_lines = chunk["code"].splitlines(keepends=True)
+        overlap = len(lines) - (chunk.get("start_line", 1) - 1)
+        # Older indices dropped blank chunks, so fill their gap with empty lines
+        lines.extend(["\n"] * -overlap)
+        lines.extend(chunk_lines[max(overlap, 0) :])
+    return "".join(lines)
@@ -1,74 +1,516 @@
 import os
 import pickle
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 import numpy as np
 from numpy.linalg import norm
 
+try:
+    import faiss
+except ImportError:  # pragma: no cover - optional dependency
+    faiss = None  # type: ignore[assignment]
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None  # type: ignore[assignment]
+
+# Metadata pickles compressed with zstandard start with the zstd frame magic,
+# which no pickle stream does
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_ZSTD_LEVEL = 3
+
+# Quantized scores are computed on blocks of rows small enough to stay in cache
+_QUANTIZED_BLOCK_ROWS = 256
+
+# With faiss installed, saved stores of at least this size also get an HNSW
+# index for approximate search
+_HNSW_MIN_SIZE = 50_000
+_HNSW_M = 32
+_HNSW_EF_SEARCH = 64
+
+# Without an HNSW index, stores of at least this size are split into about
+# sqrt(N) k-means partitions, and searches scan only the partitions whose
+# centroids are closest to the query
+_IVF_MIN_SIZE = 50_000
+_IVF_NPROBE = 16
+_IVF_ITERATIONS = 10
+_IVF_TRAIN_ROWS_PER_CLUSTER = 64
+# Vectors are assigned to centroids in blocks of this many rows
+_IVF_ASSIGN_BLOCK_ROWS = 65536
+
+
+class _Partitions(NamedTuple):
+    """Rows of the store grouped by their nearest k-means centroid."""
+
+    centroids: np.ndarray
+    # Row indices sorted by partition; partition c holds
+    # rows[offsets[c] : offsets[c + 1]]
+    rows: np.ndarray
+    offsets: np.ndarray
+    # Number of leading rows of the store that were partitioned
+    size: int
+
 
 class InMemoryVectorStore:
-    def __init__(self, pickle_path: Optional[str] = None):
-        """Initialize an in-memory vector store with optional persistence."""
-        self.embeddings: List[np.ndarray] = []
+    def __init__(
+        self,
+        pickle_path: Optional[str] = None,
+        quantization: Optional[str] = None,
+        approximate: bool = True,
+        nprobe: Optional[int] = None,
+    ):
+        """Initialize an in-memory vector store with optional persistence.
+
+        With ``quantization="int8"``, searches run against int8 codes with a
+        per-vector scale instead of the float32 embeddings. Scoring reads a
+        quarter of the bytes at a small cost in score precision, but the codes
+        are kept next to the float32 embeddings, so memory use grows by about
+        a quarter.
+
+        If faiss is installed, stores with at least ``_HNSW_MIN_SIZE`` vectors
+        build an HNSW graph when saved, and searches use it instead of
+        scanning every vector. Vectors added since the last save are still
+        scanned exactly. Without faiss, stores of at least ``_IVF_MIN_SIZE``
+        vectors are split into k-means partitions when saved, and searches
+        scan only the ``nprobe`` partitions nearest to the query
+        (``_IVF_NPROBE`` by default). Scanning more partitions raises recall
+        at the cost of speed. Pass ``approximate=False`` to always search
+        every vector exactly.
+        """
+        if quantization not in (None, "int8"):
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        if nprobe is not None and nprobe < 1:
+            raise ValueError(f"nprobe must be positive, got {nprobe}")
+
         self.metadata: List[Dict] = []
         self.pickle_path = pickle_path
+        self.quantization = quantization
+        self.approximate = approximate
+        self.nprobe = nprobe or _IVF_NPROBE
+
+        # Embeddings as one contiguous float32 matrix, grown geometrically on
+        # ``add``; rows past ``_size`` are spare.
+        self._matrix: Optional[np.ndarray] = None
+        self._size = 0
+
+        # Quantized copy of the matrix, extended lazily when searching
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+
+        # Approximate nearest neighbour index, updated and written on save
+        self._ann_index: Optional[Any] = None
+
+        # Partitions for approximate search without faiss, updated and written
+        # on save
+        self._partitions: Optional[_Partitions] = None
 
         if pickle_path and os.path.exists(pickle_path):
             self.load()
 
-    def add(self, embedding: np.ndarray, metadata: Dict) -> None:
-        """Add an embedding vector and its metadata to the store."""
-        # Normalize the embedding vector
-        normalized_embedding = embedding / norm(embedding)
-        self.embeddings.append(normalized_embedding)
-        self.metadata.append(metadata)
+    def add(self, embedding: np.ndarray, metadata: Dict, autosave: bool = True) -> None:
+        """Add an embedding vector and its metadata to the store.
+
+        Each save rewrites the whole store, so adding vectors one by one is
+        quadratic on disk. Prefer ``add_many``, or pass ``autosave=False`` and
+        call ``save`` once after the last vector.
+        """
+        self.add_many(np.asarray(embedding)[np.newaxis], [metadata], autosave=autosave)
+
+    def add_many(
+        self,
+        embeddings: np.ndarray,
+        metadata: List[Dict],
+        normalized: bool = False,
+        autosave: bool = True,
+    ) -> None:
+        """Add several embedding vectors and their metadata to the store.
+
+        The vectors are copied into the matrix and normalized there in one
+        pass, which can be skipped by passing ``normalized=True`` if they
+        already have unit length. The store is saved once, unless
+        ``autosave=False``.
+        """
+        if len(embeddings) != len(metadata):
+            raise ValueError("Number of embeddings and metadata entries must match")
+        if not metadata:
+            return
+
+        start = self._size
+        self._append_rows(np.asarray(embeddings, dtype=np.float32))
+        if not normalized:
+            # Normalize all new rows at once
+            _normalize_rows(self._get_matrix()[start:])
+        self.metadata.extend(metadata)
 
         # Auto-save if pickle path is set
-        if self.pickle_path:
+        if autosave and self.pickle_path:
             self.save()
 
     def search(
         self, query_embedding: np.ndarray, top_k: int = 5
     ) -> List[Tuple[Dict, float]]:
         """Search for most similar vectors using cosine similarity."""
-        if not self.embeddings:
+        if not self._size or top_k <= 0:
             return []
 
-        # Normalize query vector
-        query_embedding = query_embedding / norm(query_embedding)
+        # Normalize query vector unless it already has unit length
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        squared_norm = float(query_embedding @ query_embedding)
+        if squared_norm > 0 and abs(squared_norm - 1.0) > 1e-4:
+            query_embedding = query_embedding / np.sqrt(squared_norm)
 
-        # Convert list to numpy array for faster computation
-        embeddings_array = np.array(self.embeddings)
+        if self.approximate:
+            if self._ann_index is not None:
+                return self._ann_search(self._ann_index, query_embedding, top_k)
+            # Saved stores are partitioned on save, so this only builds
+            # partitions for stores that were never saved
+            partitions = self._update_partitions()
+            if partitions is not None:
+                return self._partitioned_search(partitions, query_embedding, top_k)
 
-        # Compute cosine similarities
-        similarities = np.dot(embeddings_array, query_embedding)
+        if self.quantization == "int8":
+            similarities = self._quantized_similarities(query_embedding)
+        else:
+            # Compute cosine similarities with a single matrix-vector product
+            similarities = self._get_matrix() @ query_embedding
 
         # Get top k indices
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        top_indices = _top_k_indices(similarities, top_k)
 
         # Return metadata and scores
         return [(self.metadata[i], float(similarities[i])) for i in top_indices]
 
     def save(self) -> None:
-        """Save the vector store to disk."""
+        """Save the vector store to disk.
+
+        Embeddings are written as a float32 ``.npy`` file next to the pickle,
+        which only holds the metadata. The pickle is compressed if zstandard
+        is installed. Large stores also write their HNSW index or, without
+        faiss, their k-means partitions.
+        """
         if self.pickle_path:
+            # Write to a temporary file and swap it in, so memory-mapped
+            # readers of the previous file are left untouched
+            tmp_path = f"{self.embeddings_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, self._get_matrix())
+            os.replace(tmp_path, self.embeddings_path)
+
+            index = self._update_ann_index() if self.approximate else None
+            if index is not None:
+                tmp_path = f"{self.ann_index_path}.tmp"
+                faiss.write_index(index, tmp_path)
+                os.replace(tmp_path, self.ann_index_path)
+            elif self.approximate:
+                previous = self._partitions
+                partitions = self._update_partitions()
+                if partitions is not None and (
+                    partitions is not previous
+                    or not os.path.exists(self.partitions_path)
+                ):
+                    tmp_path = f"{self.partitions_path}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        np.savez(
+                            f,
+                            centroids=partitions.centroids,
+                            rows=partitions.rows,
+                            offsets=partitions.offsets,
+                            size=partitions.size,
+                        )
+                    os.replace(tmp_path, self.partitions_path)
+
+            data = pickle.dumps(self.metadata, protocol=pickle.HIGHEST_PROTOCOL)
+            if zstandard is not None:
+                data = zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(data)
             with open(self.pickle_path, "wb") as f:
-                pickle.dump((self.embeddings, self.metadata), f)
+                f.write(data)
 
     def load(self) -> None:
-        """Load the vector store from disk."""
+        """Load the vector store from disk.
+
+        Embeddings are memory-mapped rather than read into memory. Stores
+        saved in the older all-pickle format are still supported.
+        """
         if self.pickle_path and os.path.exists(self.pickle_path):
             with open(self.pickle_path, "rb") as f:
-                self.embeddings, self.metadata = pickle.load(f)
+                raw = f.read()
+            if raw.startswith(_ZSTD_MAGIC):
+                if zstandard is None:
+                    raise ValueError(
+                        f"{self.pickle_path} is compressed, install zstandard to load it"
+                    )
+                raw = zstandard.ZstdDecompressor().decompress(raw)
+            data = pickle.loads(raw)
+            self._matrix = None
+            self._size = 0
+            self._codes = self._scales = None
+            self._ann_index = None
+            self._partitions = None
+
+            if isinstance(data, tuple):
+                # Legacy format: embeddings and metadata pickled together
+                embeddings, self.metadata = data
+                if len(embeddings):
+                    # Older stores may hold unnormalized vectors
+                    matrix = np.array(embeddings, dtype=np.float32)
+                    _normalize_rows(matrix)
+                    self._matrix = matrix
+                    self._size = len(matrix)
+                return
+
+            self.metadata = data
+            # The embeddings file is written first, so it can hold rows from
+            # an interrupted save that have no metadata yet
+            matrix = np.load(self.embeddings_path, mmap_mode="r")
+            matrix = matrix[: len(self.metadata)]
+            if len(matrix):
+                self._matrix = matrix
+                self._size = len(matrix)
+
+            if not self.approximate:
+                return
+            if faiss is not None and os.path.exists(self.ann_index_path):
+                index = faiss.read_index(self.ann_index_path)
+                if index.ntotal <= self.size:
+                    self._ann_index = index
+            if os.path.exists(self.partitions_path):
+                with np.load(self.partitions_path) as saved:
+                    partitions = _Partitions(
+                        saved["centroids"],
+                        saved["rows"],
+                        saved["offsets"],
+                        int(saved["size"]),
+                    )
+                if partitions.size <= self.size:
+                    self._partitions = partitions
 
     def clear(self) -> None:
         """Clear all vectors and metadata from the store."""
-        self.embeddings = []
         self.metadata = []
-        if self.pickle_path and os.path.exists(self.pickle_path):
-            os.remove(self.pickle_path)
+        self._matrix = None
+        self._size = 0
+        self._codes = self._scales = None
+        self._ann_index = None
+        self._partitions = None
+        if self.pickle_path:
+            for path in (
+                self.pickle_path,
+                self.embeddings_path,
+                self.ann_index_path,
+                self.partitions_path,
+            ):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """Return a read-only view of the stored embeddings, one per row."""
+        matrix: np.ndarray = self._get_matrix().view()
+        matrix.flags.writeable = False
+        return matrix
+
+    @property
+    def embeddings_path(self) -> str:
+        """Return the path of the ``.npy`` file holding the embeddings."""
+        return f"{self.pickle_path}.npy"
+
+    @property
+    def ann_index_path(self) -> str:
+        """Return the path of the file holding the HNSW index."""
+        return f"{self.pickle_path}.faiss"
+
+    @property
+    def partitions_path(self) -> str:
+        """Return the path of the file holding the k-means partitions."""
+        return f"{self.pickle_path}.ivf.npz"
+
+    def _update_ann_index(self) -> Optional[Any]:
+        """Add any new vectors to the HNSW index, creating it if needed.
+
+        Returns None unless faiss is installed and the store holds at least
+        ``_HNSW_MIN_SIZE`` vectors.
+        """
+        if faiss is None or self.size < _HNSW_MIN_SIZE:
+            return None
+
+        matrix = self._get_matrix()
+        index = self._ann_index
+        if index is None:
+            index = faiss.IndexHNSWFlat(
+                matrix.shape[1], _HNSW_M, faiss.METRIC_INNER_PRODUCT
+            )
+            self._ann_index = index
+        if index.ntotal < len(matrix):
+            index.add(np.ascontiguousarray(matrix[index.ntotal :]))
+        return index
+
+    def _ann_search(
+        self, index: Any, query_embedding: np.ndarray, top_k: int
+    ) -> List[Tuple[Dict, float]]:
+        """Search the HNSW index and scan the vectors added after it."""
+        index.hnsw.efSearch = max(_HNSW_EF_SEARCH, top_k)
+        scores, ids = index.search(query_embedding[np.newaxis], top_k)
+        found = ids[0] >= 0
+        ids, scores = ids[0][found], scores[0][found]
+
+        # Merge in exact scores for rows the index does not cover yet
+        tail = self._get_matrix()[index.ntotal :]
+        if len(tail):
+            ids = np.concatenate([ids, np.arange(index.ntotal, self._size)])
+            scores = np.concatenate([scores, tail @ query_embedding])
+
+        top_indices = _top_k_indices(scores, top_k)
+        return [(self.metadata[ids[i]], float(scores[i])) for i in top_indices]
+
+    def _update_partitions(self) -> Optional[_Partitions]:
+        """Rebuild the k-means partitions if they are missing or stale.
+
+        Partitions are rebuilt once the store has grown by half since they
+        were built; rows added before that are always scanned. Returns None
+        unless the store holds at least ``_IVF_MIN_SIZE`` vectors.
+        """
+        if self._size < _IVF_MIN_SIZE:
+            return None
+        partitions = self._partitions
+        if partitions is None or self._size > 1.5 * partitions.size:
+            partitions = self._partitions = _build_partitions(self._get_matrix())
+        return partitions
+
+    def _partitioned_search(
+        self, partitions: _Partitions, query_embedding: np.ndarray, top_k: int
+    ) -> List[Tuple[Dict, float]]:
+        """Search the partitions nearest to the query exactly."""
+        probes = _top_k_indices(partitions.centroids @ query_embedding, self.nprobe)
+        candidates = np.concatenate(
+            [
+                partitions.rows[partitions.offsets[c] : partitions.offsets[c + 1]]
+                for c in probes
+            ]
+            + [np.arange(partitions.size, self._size)]
+        )
+        # Read candidate rows in storage order
+        candidates.sort()
+
+        scores = self._get_matrix()[candidates] @ query_embedding
+        top_indices = _top_k_indices(scores, top_k)
+        return [(self.metadata[candidates[i]], float(scores[i])) for i in top_indices]
+
+    def _get_matrix(self) -> np.ndarray:
+        """Return the stored embeddings as a contiguous float32 matrix."""
+        if self._matrix is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._matrix[: self._size]
+
+    def _append_rows(self, rows: np.ndarray) -> None:
+        """Append rows to the matrix, doubling its capacity when full.
+
+        A memory-mapped matrix has no spare rows, so the first append copies
+        it into memory.
+        """
+        matrix = self._matrix
+        if matrix is None:
+            matrix = np.empty((0, rows.shape[1]), dtype=np.float32)
+        new_size = self._size + len(rows)
+        if new_size > len(matrix):
+            capacity = max(2 * self._size, new_size, 8)
+            grown = np.empty((capacity, matrix.shape[1]), np.float32)
+            grown[: self._size] = matrix[: self._size]
+            self._matrix = matrix = grown
+        matrix[self._size : new_size] = rows
+        self._size = new_size
+
+    def _quantized_similarities(self, query_embedding: np.ndarray) -> np.ndarray:
+        """Compute similarities against the int8 codes of the stored vectors."""
+        matrix = self._get_matrix()
+        codes, scales = self._codes, self._scales
+        if codes is None or scales is None:
+            codes = np.empty((0, matrix.shape[1]), dtype=np.int8)
+            scales = np.empty(0, dtype=np.float32)
+
+        # Quantize rows added since the last search
+        if len(codes) < len(matrix):
+            new_codes, new_scales = _quantize_int8(matrix[len(codes) :])
+            codes = np.concatenate([codes, new_codes])
+            scales = np.concatenate([scales, new_scales])
+        self._codes, self._scales = codes, scales
+
+        # Dequantize block by block, so only int8 codes are read from memory
+        similarities = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _QUANTIZED_BLOCK_ROWS):
+            block = codes[start : start + _QUANTIZED_BLOCK_ROWS]
+            similarities[start : start + len(block)] = (
+                block.astype(np.float32) @ query_embedding
+            )
+        similarities *= scales
+        return similarities
 
     @property
     def size(self) -> int:
         """Return the number of vectors in the store."""
-        return len(self.embeddings)
+        return self._size
+
+
+def _normalize_rows(vectors: np.ndarray) -> None:
+    """Scale each row to unit length in place, leaving zero rows as they are."""
+    norms = norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms > 0, norms, 1.0)
+
+
+def _build_partitions(vectors: np.ndarray) -> _Partitions:
+    """Partition unit vectors with spherical k-means (Lloyd's algorithm).
+
+    Centroids are trained on a sample of the vectors, then every vector is
+    assigned to its nearest centroid.
+    """
+    rng = np.random.default_rng(0)
+    n_clusters = max(int(np.sqrt(len(vectors))), 1)
+    n_train = min(len(vectors), n_clusters * _IVF_TRAIN_ROWS_PER_CLUSTER)
+    train = vectors[np.sort(rng.choice(len(vectors), n_train, replace=False))]
+
+    centroids = train[rng.choice(n_train, n_clusters, replace=False)].copy()
+    for _ in range(_IVF_ITERATIONS):
+        assignments = _nearest_centroids(train, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, train)
+        # Empty partitions keep their previous centroid
+        filled = np.bincount(assignments, minlength=n_clusters) > 0
+        centroids[filled] = sums[filled]
+        _normalize_rows(centroids)
+
+    assignments = _nearest_centroids(vectors, centroids)
+    rows = np.argsort(assignments, kind="stable")
+    offsets = np.zeros(n_clusters + 1, dtype=np.intp)
+    np.cumsum(np.bincount(assignments, minlength=n_clusters), out=offsets[1:])
+    return _Partitions(centroids, rows, offsets, len(vectors))
+
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Return the index of the most similar centroid for each vector."""
+    assignments = np.empty(len(vectors), dtype=np.intp)
+    # Score in blocks to bound the size of the similarity matrix
+    for start in range(0, len(vectors), _IVF_ASSIGN_BLOCK_ROWS):
+        block = vectors[start : start + _IVF_ASSIGN_BLOCK_ROWS]
+        assignments[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def _quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantize vectors to int8 codes with one scale per vector."""
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.round(vectors / scales[:, np.newaxis]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the indices of the k highest scores, best first.
+
+    Uses a partial selection so only the k winners are sorted.
+    """
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k >= len(scores):
+        return np.argsort(scores)[::-1]
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]
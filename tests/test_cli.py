@@ -8,7 +8,7 @@ from code_rag_server.cli import _index_repository, cli
 
 BASE_PATH = Path(__file__).resolve().parent.parent
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_metadata():
     """Create mock metadata for testing."""
     return {
@@ -42,7 +42,7 @@ def mock_embedding_service():
         mock_class.return_value = mock_embed
         yield mock_class
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def cli_runner():
     """Create a Click CLI test runner."""
     return CliRunner()
@@ -64,9 +64,8 @@ def test_index_command(cli_runner, tmp_path, mock_vector_store, mock_embedding_s
     with (
         patch("pathlib.Path.exists", return_value=True),
         patch("pathlib.Path.relative_to", return_value=Path("test-repo")),
-        patch("pathlib.Path.rglob") as mock_rglob
+        patch("code_rag_server.server.indices_dir", tmp_path / "indices"),
     ):
-        mock_rglob.return_value = [repo_path / "test.py"]
         result = cli_runner.invoke(cli, ["index", str(repo_path)])
         assert result.exit_code == 0
         assert "Starting indexing process" in result.output
@@ -118,6 +117,49 @@ def test_search_command(cli_runner, mock_metadata):
         # Verify mocks were called correctly
         mock_store.search.assert_called_once()
 
+def test_search_command_exact(cli_runner, mock_metadata):
+    """Test that search options are passed on to the vector store."""
+    mock_store = MagicMock()
+    mock_store.search.return_value = [(mock_metadata, 0.95)]
+    mock_embed = AsyncMock()
+    mock_embed.get_embedding = AsyncMock(return_value=[0.1] * 768)
+
+    with (
+        patch(
+            "code_rag_server.cli.InMemoryVectorStore", return_value=mock_store
+        ) as MockStore,
+        patch("code_rag_server.cli.EmbeddingService", return_value=mock_embed),
+        patch("pathlib.Path.exists", return_value=True),
+        patch("pathlib.Path.glob", return_value=[Path("indices/test-repo.pkl")]),
+    ):
+        result = cli_runner.invoke(cli, ["search", "test", "--exact", "--nprobe", "32"])
+
+    assert result.exit_code == 0
+    MockStore.assert_called_once_with(
+        pickle_path=str(Path("indices/test-repo.pkl")), approximate=False, nprobe=32
+    )
+
+def test_search_file_mode_groups_chunks(cli_runner):
+    """Test that file search lists each file once with its full content."""
+    mock_store = MagicMock()
+    mock_store.metadata = [
+        {"file": "src/big.py", "repo": "repo", "code": "a\nb\n", "start_line": 1},
+        {"file": "src/big.py", "repo": "repo", "code": "b\nc\n", "start_line": 2},
+        {"file": "src/other_big.py", "repo": "repo", "code": "d\n", "start_line": 1},
+    ]
+
+    with (
+        patch("code_rag_server.cli.InMemoryVectorStore", return_value=mock_store),
+        patch("pathlib.Path.exists", return_value=True),
+        patch("pathlib.Path.glob", return_value=[Path("indices/repo.pkl")]),
+    ):
+        result = cli_runner.invoke(cli, ["search", "big", "--file-mode", "-n", "2"])
+
+    assert result.exit_code == 0
+    assert result.output.count("File: src/big.py") == 1
+    assert "File: src/other_big.py" in result.output
+    assert "a\nb\nc\n" in result.output
+
 def test_invalid_num_results(cli_runner):
     """Test search command with invalid number of results."""
     result = cli_runner.invoke(cli, ["search", "test", "-n", "-1"])
@@ -152,12 +194,10 @@ async def test_index_repository(tmp_path, mock_vector_store, mock_embedding_serv
     (repo_path / "test.py").write_text("def test(): pass")
 
     with patch("code_rag_server.vector_store.InMemoryVectorStore", mock_vector_store):
-        mock_rglob = MagicMock()
-        mock_rglob.return_value = [repo_path / "test.py"]
         with (
             patch("pathlib.Path.exists", return_value=True),
             patch("pathlib.Path.relative_to", return_value=Path("test-repo")),
-            patch("pathlib.Path.rglob", mock_rglob),
+            patch("code_rag_server.server.indices_dir", tmp_path / "indices"),
             patch("httpx.AsyncClient.post") as mock_post
         ):
             mock_post.return_value = MagicMock(
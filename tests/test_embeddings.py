@@ -1,3 +1,4 @@
+import asyncio
 from unittest.mock import MagicMock, patch
 
 import numpy as np
@@ -13,7 +14,7 @@ def embedding_service():
     return EmbeddingService()
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_response():
     """Create a mock successful response."""
     return {
@@ -27,7 +28,7 @@ def mock_response():
     }
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_batch_response():
     """Create a mock response for batch processing."""
     return {
@@ -40,6 +41,33 @@ def mock_batch_response():
     }
 
 
+@pytest.fixture
+def sent_batches():
+    """Patch the API to embed each text as a vector filled with its length.
+
+    Yields the list of batches sent, each a list of input texts.
+    """
+    batches = []
+
+    async def mock_post(*args, **kwargs):
+        input_texts = kwargs["json"]["input"]
+        batches.append(input_texts)
+        return MagicMock(
+            raise_for_status=MagicMock(),
+            json=MagicMock(
+                return_value={
+                    "data": [
+                        {"embedding": [float(len(t))] * 768, "index": i}
+                        for i, t in enumerate(input_texts)
+                    ]
+                }
+            ),
+        )
+
+    with patch("httpx.AsyncClient.post", side_effect=mock_post):
+        yield batches
+
+
 @pytest.mark.asyncio
 async def test_get_single_embedding(embedding_service, mock_response):
     """Test getting embedding for a single text."""
@@ -74,20 +102,16 @@ async def test_batch_embeddings(embedding_service, mock_batch_response):
 
 
 @pytest.mark.asyncio
-async def test_batch_processing(embedding_service, mock_batch_response):
+async def test_batch_processing(embedding_service, sent_batches):
     """Test batch processing with specific batch size."""
-    with patch("httpx.AsyncClient.post") as mock_post:
-        mock_post.return_value = MagicMock(
-            raise_for_status=MagicMock(),
-            json=MagicMock(return_value=mock_batch_response),
-        )
-
-        texts = ["text1", "text2", "text3", "text4", "text5"]
-        embeddings = await embedding_service.get_batch_embeddings(texts, batch_size=2)
+    texts = ["text1", "text2", "text3", "text4", "text5"]
+    embeddings = await embedding_service.get_batch_embeddings(texts, batch_size=2)
 
-        assert isinstance(embeddings, list)
-        assert all(isinstance(emb, np.ndarray) for emb in embeddings)
-        assert all(emb.shape == (768,) for emb in embeddings)
+    assert isinstance(embeddings, np.ndarray)
+    assert embeddings.shape == (5, 768)
+    assert embeddings.dtype == np.float32
+    assert all(emb.shape == (768,) for emb in embeddings)
+    assert sorted(map(len, sent_batches)) == [1, 2, 2]
 
 
 @pytest.mark.asyncio
@@ -113,6 +137,18 @@ async def test_invalid_response(embedding_service):
             await embedding_service.get_embedding("test text")
 
 
+@pytest.mark.asyncio
+async def test_short_batch_response(embedding_service, mock_response):
+    """Test that a response with too few embeddings is rejected."""
+    with patch("httpx.AsyncClient.post") as mock_post:
+        mock_post.return_value = MagicMock(
+            raise_for_status=MagicMock(), json=MagicMock(return_value=mock_response)
+        )
+
+        with pytest.raises(ValueError, match="Expected 2 embeddings, got 1"):
+            await embedding_service.get_batch_embeddings(["first", "second"])
+
+
 @pytest.mark.asyncio
 async def test_custom_api_url():
     """Test using a custom API URL."""
@@ -151,22 +187,40 @@ async def test_empty_input_handling(embedding_service):
 
 
 @pytest.mark.asyncio
-async def test_large_batch_processing(embedding_service):
+async def test_large_batch_processing(embedding_service, sent_batches):
     """Test processing of large batches."""
-    batch_size = 32
-    total_texts = 100
-    texts = ["text"] * total_texts
+    texts = [f"text{i}" for i in range(100)]
+    embeddings = await embedding_service.get_batch_embeddings(texts, batch_size=32)
+
+    # Verify results
+    assert len(embeddings) == 100
+    assert all(isinstance(emb, np.ndarray) for emb in embeddings)
+    assert all(emb.shape == (768,) for emb in embeddings)
+    assert max(map(len, sent_batches)) == 32
+
+
+@pytest.mark.asyncio
+async def test_concurrent_batch_processing(embedding_service):
+    """Test that batches run concurrently and results keep input order."""
+    texts = [f"text{i}" for i in range(10)]
+    in_flight = 0
+    max_in_flight = 0
 
     async def mock_post(*args, **kwargs):
-        # Create response based on the input size
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
         input_texts = kwargs["json"]["input"]
         return MagicMock(
             raise_for_status=MagicMock(),
             json=MagicMock(
                 return_value={
                     "data": [
-                        {"embedding": [0.1] * 768, "index": i}
-                        for i in range(len(input_texts))
+                        {"embedding": [float(t[4:])] * 768, "index": i}
+                        for i, t in enumerate(input_texts)
                     ]
                 }
             ),
@@ -174,10 +228,123 @@ async def test_large_batch_processing(embedding_service):
 
     with patch("httpx.AsyncClient.post", side_effect=mock_post):
         embeddings = await embedding_service.get_batch_embeddings(
-            texts, batch_size=batch_size
+            texts, batch_size=2, max_concurrency=3
         )
 
-        # Verify results
-        assert len(embeddings) == total_texts
-        assert all(isinstance(emb, np.ndarray) for emb in embeddings)
-        assert all(emb.shape == (768,) for emb in embeddings)
+        assert max_in_flight == 3
+        assert [emb[0] for emb in embeddings] == [float(i) for i in range(10)]
+
+        # Without an override the service's limit applies
+        max_in_flight = 0
+        embedding_service.max_concurrent = 2
+        texts = [f"text{i}" for i in range(10, 20)]
+        await embedding_service.get_batch_embeddings(texts, batch_size=2)
+        assert max_in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_client_reused_across_requests(embedding_service, mock_response):
+    """Test that one HTTP client is shared by requests until closed."""
+    with patch("httpx.AsyncClient.post") as mock_post:
+        mock_post.return_value = MagicMock(
+            raise_for_status=MagicMock(), json=MagicMock(return_value=mock_response)
+        )
+
+        await embedding_service.get_embedding("first")
+        client = embedding_service.client
+        assert client.timeout.read == 60.0
+        await embedding_service.get_embedding("second")
+        assert embedding_service.client is client
+
+    await embedding_service.aclose()
+    assert client.is_closed
+    assert embedding_service.client is not client
+    await embedding_service.aclose()
+
+
+@pytest.mark.asyncio
+async def test_batches_grouped_by_length(embedding_service, sent_batches):
+    """Test that batches hold similarly sized texts and results keep input order."""
+    texts = ["a" * n for n in (5, 1, 4, 2, 3, 6)]
+    embeddings = await embedding_service.get_batch_embeddings(texts, batch_size=2)
+
+    assert sorted(sent_batches) == [["a", "aa"], ["aaa", "aaaa"], ["aaaaa", "aaaaaa"]]
+    assert [emb[0] for emb in embeddings] == [5.0, 1.0, 4.0, 2.0, 3.0, 6.0]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_single_embeddings_coalesced(embedding_service, sent_batches):
+    """Test that concurrent single-text requests share one HTTP request."""
+    embeddings = await asyncio.gather(
+        *(embedding_service.get_embedding("a" * n) for n in (3, 1, 2, 4))
+    )
+    # The first request goes out alone, the rest wait for it together
+    assert sent_batches == [["aaa"], ["a", "aa", "aaaa"]]
+    assert [emb[0] for emb in embeddings] == [3.0, 1.0, 2.0, 4.0]
+
+
+@pytest.mark.asyncio
+async def test_single_embedding_sent_without_delay(embedding_service, mock_response):
+    """Test that a lone single-text request does not wait to be batched."""
+    with (
+        patch("httpx.AsyncClient.post") as mock_post,
+        patch("code_rag_server.embeddings._MICRO_BATCH_WAIT", 60.0),
+    ):
+        mock_post.return_value = MagicMock(
+            raise_for_status=MagicMock(), json=MagicMock(return_value=mock_response)
+        )
+        embedding = await asyncio.wait_for(
+            embedding_service.get_embedding("lone query"), timeout=1.0
+        )
+
+    assert len(embedding) == 768
+
+
+@pytest.mark.asyncio
+async def test_coalesced_request_error(embedding_service):
+    """Test that a failed coalesced request raises for every caller."""
+    with patch("httpx.AsyncClient.post", side_effect=HTTPError("API Error")):
+        results = await asyncio.gather(
+            embedding_service.get_embedding("first"),
+            embedding_service.get_embedding("second"),
+            return_exceptions=True,
+        )
+
+    assert all(isinstance(result, HTTPError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_repeated_texts_served_from_cache(embedding_service, sent_batches):
+    """Test that repeated texts are embedded once and then served from cache."""
+    embedding_service.max_cache_entries = 2
+    embeddings = await embedding_service.get_batch_embeddings(
+        ["aa", "b", "aa", "b"], batch_size=1
+    )
+    assert sorted(sent_batches) == [["aa"], ["b"]]
+    assert [emb[0] for emb in embeddings] == [2.0, 1.0, 2.0, 1.0]
+
+    embedding = await embedding_service.get_embedding("aa")
+    assert embedding[0] == 2.0
+    assert len(sent_batches) == 2
+
+    # The least recently used text is evicted
+    await embedding_service.get_embedding("ccc")
+    await embedding_service.get_batch_embeddings(["aa", "b"])
+    assert sent_batches[2:] == [["ccc"], ["b"]]
+
+
+@pytest.mark.asyncio
+async def test_batches_limited_by_characters(embedding_service, sent_batches):
+    """Test that batches are closed once they would exceed max_chars."""
+    texts = ["a" * n for n in (1, 2, 3, 4, 10, 12)]
+    embeddings = await embedding_service.get_batch_embeddings(
+        texts, batch_size=3, max_chars=10
+    )
+
+    assert sorted([len(t) for t in batch] for batch in sent_batches) == [
+        [1, 2, 3],
+        [4],
+        [10],
+        [12],
+    ]
+    assert [emb[0] for emb in embeddings] == [1.0, 2.0, 3.0, 4.0, 10.0, 12.0]
@@ -1,23 +1,32 @@
+import os
+import random
 import subprocess
+import threading
 from pathlib import Path
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
 from code_rag_server.server import (
+    _chunk_file,
     _clone_github_repo,
+    _get_store,
     _guess_language,
+    _iter_files,
+    _read_chunks,
+    _read_source,
     _should_ignore,
     _validate_github_url,
     handle_call_tool,
     handle_list_tools,
     update_index,
 )
+from code_rag_server.utils import join_chunks
 
 BASE_PATH = Path(__file__).resolve().parent.parent
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_metadata():
     """Create mock metadata for testing."""
     return {
@@ -28,7 +37,7 @@ def mock_metadata():
     }
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_embedding_result():
     """Create a mock embedding result."""
     return [0.1] * 768  # Match embedding dimension
@@ -106,6 +115,8 @@ async def test_clone_github_repo_with_branch(tmp_path):
         cmd_args = mock_run.call_args[0][0]
         assert "-b" in cmd_args
         assert "dev" in cmd_args
+        assert "--depth=1" in cmd_args
+        assert "--single-branch" in cmd_args
         assert isinstance(repo_path, Path)
 
 
@@ -127,11 +138,73 @@ async def test_clone_github_repo_error():
 # Test file operations
 def test_should_ignore():
     """Test file ignore patterns."""
-    assert _should_ignore(Path(".git/config"))
-    assert _should_ignore(Path("node_modules/package.json"))
-    assert _should_ignore(Path("venv/lib/python3.8"))
-    assert not _should_ignore(Path("src/main.py"))
-    assert not _should_ignore(Path("README.md"))
+    assert _should_ignore(".git/config")
+    assert _should_ignore("node_modules/package.json")
+    assert _should_ignore("venv/lib/python3.8")
+    assert not _should_ignore("src/main.py")
+    assert not _should_ignore("README.md")
+    assert _should_ignore("src/module.cpython-311.so")
+    assert _should_ignore("docs/Logo.PNG")
+    assert not _should_ignore("src/so.py")
+    assert _should_ignore("config/.env")
+    assert not _should_ignore("src/.env.example")
+    assert not _should_ignore("docs/git/venvs.md")
+    assert not _should_ignore(".pdf")
+    # File names alone, as _iter_files passes them
+    assert _should_ignore(".env")
+    assert _should_ignore("logo.png")
+    assert not _should_ignore("main.py")
+
+
+def test_iter_files(tmp_path):
+    """Test walking a repository while pruning ignored directories."""
+    for name in ("src/main.py", "README.md", ".git/config", "node_modules/a/b.js"):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text("content")
+    (tmp_path / "src" / "main.cpython-311.pyc").write_bytes(b"\x00")
+
+    files = {path.relative_to(tmp_path).as_posix() for path in _iter_files(tmp_path)}
+    assert files == {"src/main.py", "README.md"}
+
+
+def test_read_chunks(tmp_path):
+    """Test reading a file into chunks with their metadata."""
+    (tmp_path / "src").mkdir()
+    source = tmp_path / "src" / "main.py"
+    source.write_text("def main():\n    pass\n")
+
+    chunks = _read_chunks(source, tmp_path, Path("owner/repo"))
+    assert chunks == [
+        (
+            "def main():\n    pass\n",
+            {
+                "file": str(Path("src/main.py")),
+                "repo": str(Path("owner/repo")),
+                "code": "def main():\n    pass\n",
+                "language": "python",
+                "start_line": 1,
+                "end_line": 2,
+            },
+        )
+    ]
+
+    binary = tmp_path / "data.bin"
+    binary.write_bytes(b"\x00\x01")
+    assert _read_chunks(binary, tmp_path, Path("owner/repo")) is None
+
+
+def test_read_source(tmp_path):
+    """Test that binary and oversized files are not read for indexing."""
+    text_file = tmp_path / "main.py"
+    text_file.write_text("def main(): pass")
+    binary_file = tmp_path / "data.bin"
+    binary_file.write_bytes(b"header\x00\x01\x02")
+    large_file = tmp_path / "large.txt"
+    large_file.write_text("x" * (1024 * 1024 + 1))
+
+    assert _read_source(text_file) == "def main(): pass"
+    assert _read_source(binary_file) is None
+    assert _read_source(large_file) is None
 
 
 def test_guess_language():
@@ -142,6 +215,89 @@ def test_guess_language():
     assert _guess_language(Path("unknown.xyz")) == ""
 
 
+def test_chunk_file():
+    """Test splitting file content into overlapping line chunks."""
+    content = "".join(f"line {i}\n" for i in range(1, 151))
+    chunks = _chunk_file(content)
+
+    assert [(start, end) for _, start, end in chunks] == [
+        (1, 60),
+        (51, 110),
+        (101, 150),
+    ]
+    assert chunks[0][0].startswith("line 1\n")
+    assert chunks[-1][0].endswith("line 150\n")
+    assert _chunk_file("") == []
+    assert _chunk_file("\n  \n") == []
+
+
+def test_chunk_file_long_lines():
+    """Test that chunks are limited by size as well as line count."""
+    content = ("x" * 1500 + "\n") * 3
+    chunks = _chunk_file(content)
+    assert [(start, end) for _, start, end in chunks] == [(1, 1), (2, 2), (3, 3)]
+
+
+def test_join_chunks_roundtrip():
+    """Test reassembling file content from its chunks."""
+    content = "".join(f"line {i}\n" for i in range(1, 151))
+    chunks = [
+        {"code": text, "start_line": start, "end_line": end}
+        for text, start, end in reversed(_chunk_file(content))
+    ]
+    assert join_chunks(chunks) == content
+    assert join_chunks([{"code": "def test(): pass"}]) == "def test(): pass"
+
+
+def _roundtrip(content):
+    """Chunk content and reassemble it from the chunk metadata."""
+    chunks = [
+        {"code": text, "start_line": start, "end_line": end}
+        for text, start, end in _chunk_file(content)
+    ]
+    return join_chunks(chunks)
+
+
+def test_join_chunks_roundtrip_blank_and_long_lines():
+    """Test that blank runs and long lines survive chunking unchanged."""
+    long_line = "x" * 2100 + "\n"
+    for content in (
+        "a\n" + "\n" * 200 + "b\n",
+        "a\n" + "\n" * 200,
+        "  \n" * 100 + "a\n",
+        long_line + "\n" + long_line,
+        "a\n  \n\t\n" + long_line * 2 + "b",
+    ):
+        assert _roundtrip(content) == content
+
+    rng = random.Random(0)
+    for _ in range(50):
+        lines = [
+            rng.choice(["", "   ", "code", "y" * rng.randint(100, 2500)]) + "\n"
+            for _ in range(rng.randint(1, 300))
+        ]
+        content = "".join(lines)
+        assert _roundtrip(content) == content
+
+
+def test_chunk_file_windows_advance():
+    """Test that no chunk is repeated as part of the one before it."""
+    content = "short\n" * 15 + "y" * 1990 + "\n" + "short\n" * 5
+    chunks = _chunk_file(content)
+    ends = [end for _, _, end in chunks]
+    assert ends == sorted(set(ends))
+    assert _roundtrip(content) == content
+
+
+def test_join_chunks_fills_dropped_blank_chunks():
+    """Test that gaps left by older indices are filled with empty lines."""
+    chunks = [
+        {"code": "a\n", "start_line": 1},
+        {"code": "b\n", "start_line": 4},
+    ]
+    assert join_chunks(chunks) == "a\n\n\nb\n"
+
+
 # Test MCP server functionality
 @pytest.mark.asyncio
 async def test_handle_list_tools():
@@ -185,14 +341,13 @@ async def test_handle_call_tool_update_index(tmp_path, mock_metadata):
     with (
         patch("pathlib.Path.exists", return_value=True),
         patch("pathlib.Path.relative_to", return_value=Path("test-repo")),
-        patch("pathlib.Path.rglob") as mock_rglob,
+        patch("code_rag_server.server.indices_dir", tmp_path / "indices"),
         patch("code_rag_server.vector_store.InMemoryVectorStore") as MockStore,
         patch(
             "code_rag_server.embeddings.EmbeddingService.get_batch_embeddings",
             new_callable=AsyncMock,
         ) as mock_embed,
     ):
-        mock_rglob.return_value = [test_file]
         mock_store = MockStore.return_value
         mock_store.size = 0  # Indicate no existing index
         mock_embed.return_value = [[0.1] * 768]
@@ -220,14 +375,13 @@ async def test_update_index(tmp_path, mock_metadata):
     with (
         patch("pathlib.Path.exists", return_value=True),
         patch("pathlib.Path.relative_to", return_value=Path("test-repo")),
-        patch("pathlib.Path.rglob") as mock_rglob,
+        patch("code_rag_server.server.indices_dir", tmp_path / "indices"),
         patch("code_rag_server.vector_store.InMemoryVectorStore") as MockStore,
         patch(
             "code_rag_server.embeddings.EmbeddingService.get_batch_embeddings",
             new_callable=AsyncMock,
         ) as mock_embed,
     ):
-        mock_rglob.return_value = [test_file]
         mock_store = MockStore.return_value
         mock_store.size = 0  # Indicate no existing index
         mock_embed.return_value = [[0.1] * 768]
@@ -245,3 +399,282 @@ async def test_update_index_nonexistent_path():
     with patch("pathlib.Path.exists", return_value=False):
         result = await update_index(Path("/nonexistent/path"))
         assert "path does not exist" in result[0].text
+
+
+@pytest.mark.asyncio
+async def test_handle_call_tool_search_code_embeds_query_once(tmp_path, mock_metadata):
+    """Test that search_code embeds the query once across repositories."""
+    for name in ("repo-a", "repo-b"):
+        (tmp_path / f"{name}.pkl").touch()
+
+    mock_store = MagicMock()
+    mock_store.size = 1
+    mock_store.search.return_value = [(mock_metadata, 0.95)]
+
+    with (
+        patch("code_rag_server.server.indices_dir", tmp_path),
+        patch("code_rag_server.server.InMemoryVectorStore", return_value=mock_store),
+        patch(
+            "code_rag_server.server.embedding_service.get_embedding",
+            new_callable=AsyncMock,
+        ) as mock_embed,
+    ):
+        mock_embed.return_value = [0.1] * 768
+
+        result = await handle_call_tool(
+            "search_code", {"query": "test function", "num_results": 1}
+        )
+
+        mock_embed.assert_awaited_once_with("test function")
+        assert mock_store.search.call_count == 2
+        assert "File: test.py" in result[0].text
+        assert result[0].text.count("File:") == 1
+
+
+@pytest.mark.asyncio
+async def test_search_code_reuses_loaded_store(tmp_path, mock_metadata):
+    """Test that repeated searches reuse a store until its index changes."""
+    pickle_file = tmp_path / "repo.pkl"
+    pickle_file.touch()
+
+    mock_store = MagicMock()
+    mock_store.size = 1
+    mock_store.search.return_value = [(mock_metadata, 0.95)]
+
+    with (
+        patch("code_rag_server.server.indices_dir", tmp_path),
+        patch(
+            "code_rag_server.server.InMemoryVectorStore", return_value=mock_store
+        ) as MockStore,
+        patch(
+            "code_rag_server.server.embedding_service.get_embedding",
+            new_callable=AsyncMock,
+            return_value=[0.1] * 768,
+        ),
+    ):
+        await handle_call_tool("search_code", {"query": "test"})
+        await handle_call_tool("search_code", {"query": "test"})
+        assert MockStore.call_count == 1
+        MockStore.assert_called_with(
+            pickle_path=str(pickle_file),
+            quantization=None,
+            approximate=True,
+            nprobe=None,
+        )
+
+        stat = pickle_file.stat()
+        os.utime(pickle_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        await handle_call_tool("search_code", {"query": "test"})
+        assert MockStore.call_count == 2
+
+
+def test_get_store_uses_configured_settings(tmp_path):
+    """Test that cached stores are loaded with the configured search settings."""
+    pickle_file = tmp_path / "repo.pkl"
+
+    with (
+        patch("code_rag_server.server.store_quantization", "int8"),
+        patch("code_rag_server.server.store_approximate", False),
+        patch("code_rag_server.server.store_nprobe", 64),
+        patch("code_rag_server.server.InMemoryVectorStore") as MockStore,
+    ):
+        _get_store(str(pickle_file), 0.0)
+
+    MockStore.assert_called_once_with(
+        pickle_path=str(pickle_file),
+        quantization="int8",
+        approximate=False,
+        nprobe=64,
+    )
+
+
+@pytest.mark.asyncio
+async def test_handle_call_tool_get_file_joins_chunks(tmp_path):
+    """Test that get_file returns the whole file assembled from its chunks."""
+    (tmp_path / "repo.pkl").touch()
+    content = "".join(f"line {i}\n" for i in range(1, 151))
+
+    mock_store = MagicMock()
+    mock_store.metadata = [
+        {
+            "file": "main.py",
+            "repo": "repo",
+            "code": text,
+            "language": "python",
+            "start_line": start,
+            "end_line": end,
+        }
+        for text, start, end in _chunk_file(content)
+    ]
+
+    with (
+        patch("code_rag_server.server.indices_dir", tmp_path),
+        patch("code_rag_server.server.InMemoryVectorStore", return_value=mock_store),
+    ):
+        result = await handle_call_tool(
+            "get_file", {"file_path": "main.py", "repository": "repo"}
+        )
+
+    assert f"```python\n{content}\n```" in result[0].text
+
+
+@pytest.mark.asyncio
+async def test_update_index_skips_unreadable_files(tmp_path):
+    """Test that files failing to read are reported and skipped."""
+    repo_path = tmp_path / "test-repo"
+    repo_path.mkdir()
+    (repo_path / "main.py").write_text("def main(): pass")
+    (repo_path / "data.txt").write_bytes(b"\xff\xfe\xfa")
+
+    with (
+        patch("pathlib.Path.relative_to", return_value=Path("test-repo")),
+        patch("code_rag_server.server.indices_dir", tmp_path / "indices"),
+        patch("code_rag_server.server.InMemoryVectorStore") as MockStore,
+        patch(
+            "code_rag_server.server.embedding_service.get_batch_embeddings",
+            new_callable=AsyncMock,
+        ) as mock_embed,
+    ):
+        mock_embed.return_value = [[0.1] * 768]
+
+        result = await update_index(repo_path)
+
+        mock_embed.assert_awaited_once_with(["def main(): pass"], show_progress=False)
+        embeddings, metadata = MockStore.return_value.add_many.call_args[0]
+        assert embeddings.shape == (1, 768)
+        assert [m["language"] for m in metadata] == ["python"]
+        assert "Successfully indexed 1 files" in result[0].text
+
+
+@pytest.mark.asyncio
+async def test_update_index_stores_off_event_loop(tmp_path):
+    """Test that the store is filled and saved in a worker thread."""
+    repo_path = tmp_path / "repo"
+    repo_path.mkdir()
+    (repo_path / "main.py").write_text("def main(): pass")
+    threads = []
+
+    with (
+        patch("pathlib.Path.relative_to", return_value=Path("test-repo")),
+        patch("code_rag_server.server.indices_dir", tmp_path / "indices"),
+        patch("code_rag_server.server.InMemoryVectorStore") as MockStore,
+        patch(
+            "code_rag_server.server.embedding_service.get_batch_embeddings",
+            new_callable=AsyncMock,
+            return_value=[[0.1] * 768],
+        ),
+    ):
+        MockStore.return_value.add_many.side_effect = lambda *args: threads.append(
+            threading.current_thread()
+        )
+        await update_index(repo_path)
+
+    assert len(threads) == 1
+    assert threads[0] is not threading.main_thread()
+
+
+@pytest.mark.asyncio
+async def test_update_index_embeds_duplicates_once(tmp_path):
+    """Test that identical files are embedded once but stored for each file."""
+    repo_path = tmp_path / "test-repo"
+    repo_path.mkdir()
+    for name in ("a.py", "b.py"):
+        (repo_path / name).write_text("LICENSE = 'MIT'")
+    (repo_path / "c.py").write_text("def main(): pass")
+
+    with (
+        patch("pathlib.Path.relative_to", return_value=Path("test-repo")),
+        patch("code_rag_server.server.indices_dir", tmp_path / "indices"),
+        patch("code_rag_server.server.InMemoryVectorStore") as MockStore,
+        patch(
+            "code_rag_server.server.embedding_service.get_batch_embeddings",
+            new_callable=AsyncMock,
+        ) as mock_embed,
+    ):
+        mock_embed.side_effect = lambda texts, **kwargs: [
+            [float(len(t))] * 4 for t in texts
+        ]
+
+        result = await update_index(repo_path)
+
+        (texts,) = mock_embed.call_args[0]
+        assert sorted(texts) == ["LICENSE = 'MIT'", "def main(): pass"]
+        embeddings, metadata = MockStore.return_value.add_many.call_args[0]
+        assert [row[0] for row in embeddings] == [len(m["code"]) for m in metadata]
+        assert len(metadata) == 3
+        assert "Successfully indexed 3 files" in result[0].text
+
+
+@pytest.mark.asyncio
+async def test_update_index_embeds_in_groups(tmp_path):
+    """Test that chunks are embedded in groups while files are read."""
+    repo_path = tmp_path / "test-repo"
+    repo_path.mkdir()
+    for i in range(5):
+        (repo_path / f"module{i}.py").write_text("x = 1\n" * (i + 1))
+    (repo_path / "copy.py").write_text("x = 1\n")
+
+    with (
+        patch("pathlib.Path.relative_to", return_value=Path("test-repo")),
+        patch("code_rag_server.server.indices_dir", tmp_path / "indices"),
+        patch("code_rag_server.server._EMBED_GROUP_SIZE", 2),
+        patch("code_rag_server.server.InMemoryVectorStore") as MockStore,
+        patch(
+            "code_rag_server.server.embedding_service.get_batch_embeddings",
+            new_callable=AsyncMock,
+        ) as mock_embed,
+    ):
+        mock_embed.side_effect = lambda texts, **kwargs: [
+            [float(len(t))] * 4 for t in texts
+        ]
+
+        result = await update_index(repo_path)
+
+        sent = [call.args[0] for call in mock_embed.call_args_list]
+        assert [len(texts) for texts in sent] == [2, 2, 1]
+        # Only the indexer's own progress bar is shown
+        assert all(
+            call.kwargs == {"show_progress": False}
+            for call in mock_embed.call_args_list
+        )
+        assert len({text for texts in sent for text in texts}) == 5
+        embeddings, metadata = MockStore.return_value.add_many.call_args[0]
+        assert [row[0] for row in embeddings] == [len(m["code"]) for m in metadata]
+        assert "Successfully indexed 6 files" in result[0].text
+
+
+@pytest.mark.asyncio
+async def test_search_code_merges_repositories(tmp_path):
+    """Test that results from all repositories are merged by score."""
+    scores = {"repo-a": [0.9, 0.5], "repo-b": [0.7, 0.6]}
+    stores = {}
+    for repo, repo_scores in scores.items():
+        (tmp_path / f"{repo}.pkl").touch()
+        store = MagicMock()
+        store.size = 2
+        store.search.return_value = [
+            ({"file": f"{score}.py", "repo": repo, "code": ""}, score)
+            for score in repo_scores
+        ]
+        stores[str(tmp_path / f"{repo}.pkl")] = store
+
+    with (
+        patch("code_rag_server.server.indices_dir", tmp_path),
+        patch(
+            "code_rag_server.server.InMemoryVectorStore",
+            side_effect=lambda pickle_path, **kwargs: stores[pickle_path],
+        ),
+        patch(
+            "code_rag_server.server.embedding_service.get_embedding",
+            new_callable=AsyncMock,
+            return_value=[0.1] * 768,
+        ),
+    ):
+        result = await handle_call_tool(
+            "search_code", {"query": "test", "num_results": 3}
+        )
+
+    text = result[0].text
+    assert text.index("File: 0.9.py") < text.index("File: 0.7.py")
+    assert text.index("File: 0.7.py") < text.index("File: 0.6.py")
+    assert "File: 0.5.py" not in text
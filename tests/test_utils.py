@@ -0,0 +1,11 @@
+from code_rag_server.utils import format_lines
+
+
+def test_format_lines():
+    """Test formatting the line range of a chunk."""
+    assert format_lines({"start_line": 3, "end_line": 12}) == " (lines 3-12)"
+
+
+def test_format_lines_without_range():
+    """Test that metadata without a line range formats as empty."""
+    assert format_lines({"file": "test.py"}) == ""
@@ -1,6 +1,6 @@
 import os
 import pickle
-import tempfile
+from unittest.mock import patch
 
 import numpy as np
 import pytest
@@ -8,13 +8,16 @@ import pytest
 from code_rag_server.vector_store import InMemoryVectorStore
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_embedding():
     """Create a sample embedding vector."""
-    return np.array([0.1, 0.2, 0.3, 0.4, 0.5])
+    # Shared by all tests, so guard against accidental modification
+    embedding = np.array([0.1, 0.2, 0.3, 0.4, 0.5])
+    embedding.flags.writeable = False
+    return embedding
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_metadata():
     """Create sample metadata."""
     return {
@@ -26,22 +29,16 @@ def sample_metadata():
 
 
 @pytest.fixture
-def temp_pickle_path():
+def temp_pickle_path(tmp_path):
     """Create a temporary file path for pickle testing."""
-    with tempfile.NamedTemporaryFile(delete=False) as f:
-        # Initialize with empty data structure
-        pickle.dump(([], []), f)
-        temp_path = f.name
-    yield temp_path
-    if os.path.exists(temp_path):
-        os.remove(temp_path)
+    return str(tmp_path / "store.pkl")
 
 
 def test_vector_store_initialization():
     """Test basic initialization of vector store."""
     store = InMemoryVectorStore()
     assert store.size == 0
-    assert store.embeddings == []
+    assert len(store.embeddings) == 0
     assert store.metadata == []
 
 
@@ -98,7 +95,9 @@ def test_persistence(sample_embedding, sample_metadata, temp_pickle_path):
     assert store2.size == 1
     assert len(store2.metadata) == 1
     assert store2.metadata[0] == sample_metadata
-    np.testing.assert_array_almost_equal(store2.embeddings[0], store1.embeddings[0])
+    np.testing.assert_array_almost_equal(
+        store2.embeddings[0], sample_embedding / np.linalg.norm(sample_embedding)
+    )
 
 
 def test_clear(temp_pickle_path):
@@ -116,6 +115,7 @@ def test_clear(temp_pickle_path):
     assert len(store.embeddings) == 0
     assert len(store.metadata) == 0
     assert not os.path.exists(temp_pickle_path)
+    assert not os.path.exists(f"{temp_pickle_path}.npy")
 
 
 def test_multiple_vectors():
@@ -171,10 +171,318 @@ def test_multiple_saves(temp_pickle_path):
 
     # Add and save multiple times
     for i in range(3):
-        store.add(np.array([0.1 * i, 0.2 * i, 0.3 * i]), {"id": i})
+        store.add(np.array([0.1 * i, 0.2 * i, 0.3 * i]), {"id": i}, autosave=False)
+        assert InMemoryVectorStore(pickle_path=temp_pickle_path).size == i
         store.save()
 
     # Verify final state
     final_store = InMemoryVectorStore(pickle_path=temp_pickle_path)
     assert final_store.size == 3
     assert [m["id"] for m in final_store.metadata] == [0, 1, 2]
+
+
+def test_zero_vectors():
+    """Test that zero vectors are stored and searched without NaN scores."""
+    store = InMemoryVectorStore()
+    store.add(np.zeros(3), {"id": 0})
+    store.add_many(np.array([[0.0, 0.0, 0.0], [0.0, 2.0, 0.0]]), [{"id": 1}, {"id": 2}])
+
+    assert not np.isnan(store.embeddings).any()
+    results = store.search(np.array([0.0, 1.0, 0.0]), top_k=3)
+    assert results[0] == ({"id": 2}, 1.0)
+    assert [score for _, score in results[1:]] == [0.0, 0.0]
+    assert all(score == 0.0 for _, score in store.search(np.zeros(3)))
+
+
+def test_search_after_incremental_add():
+    """Test that vectors added after a search are visible to later searches."""
+    store = InMemoryVectorStore()
+    store.add(np.array([1.0, 0.0, 0.0]), {"id": 1})
+    assert store.search(np.array([1.0, 0.0, 0.0]), top_k=1)[0][0]["id"] == 1
+
+    for i in range(2, 12):
+        store.add(np.array([0.0, 1.0, 0.1 * i]), {"id": i})
+    store.add(np.array([0.0, 0.0, 1.0]), {"id": 12})
+
+    results = store.search(np.array([0.0, 0.0, 1.0]), top_k=1)
+    assert results[0][0]["id"] == 12
+    assert np.isclose(results[0][1], 1.0)
+
+
+def test_search_top_k_ordering():
+    """Test that top-k results are the best matches in descending order."""
+    store = InMemoryVectorStore()
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 8))
+    for i, vec in enumerate(vectors):
+        store.add(vec, {"id": i})
+
+    query = rng.normal(size=8)
+    results = store.search(query, top_k=5)
+
+    expected = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected_scores = expected @ (query / np.linalg.norm(query))
+    assert [m["id"] for m, _ in results] == list(np.argsort(expected_scores)[::-1][:5])
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+    assert len(store.search(query, top_k=100)) == 50
+    assert store.search(query, top_k=0) == []
+
+
+def test_load_memory_maps_embeddings(temp_pickle_path):
+    """Test that saved embeddings are memory-mapped and copied on write."""
+    store = InMemoryVectorStore(pickle_path=temp_pickle_path)
+    store.add(np.array([1.0, 0.0, 0.0]), {"id": 1})
+
+    loaded = InMemoryVectorStore(pickle_path=temp_pickle_path)
+    assert isinstance(loaded._matrix, np.memmap)
+
+    # Adding to a loaded store must not touch the file it was mapped from
+    loaded.pickle_path = None
+    loaded.add(np.array([0.0, 1.0, 0.0]), {"id": 2})
+    assert loaded.size == 2
+    assert loaded.search(np.array([0.0, 1.0, 0.0]), top_k=1)[0][0]["id"] == 2
+    assert InMemoryVectorStore(pickle_path=temp_pickle_path).size == 1
+
+
+def test_load_ignores_unsaved_rows(temp_pickle_path):
+    """Test that embeddings without saved metadata are not loaded."""
+    store = InMemoryVectorStore(pickle_path=temp_pickle_path)
+    store.add(np.array([1.0, 0.0]), {"id": 1})
+
+    # Simulate an interrupted save that only replaced the embeddings file
+    np.save(store.embeddings_path, np.eye(2, dtype=np.float32))
+
+    loaded = InMemoryVectorStore(pickle_path=temp_pickle_path)
+    assert loaded.size == 1
+    assert loaded.search(np.array([0.0, 1.0]), top_k=5)[0][0] == {"id": 1}
+
+
+def test_load_legacy_pickle(temp_pickle_path, sample_embedding, sample_metadata):
+    """Test loading a store saved in the all-pickle format."""
+    with open(temp_pickle_path, "wb") as f:
+        pickle.dump(([sample_embedding], [sample_metadata]), f)
+
+    store = InMemoryVectorStore(pickle_path=temp_pickle_path)
+    assert store.size == 1
+    assert np.isclose(np.linalg.norm(store.embeddings[0]), 1.0)
+    assert store.search(sample_embedding, top_k=1)[0][0] == sample_metadata
+
+
+def test_add_many(temp_pickle_path):
+    """Test adding several vectors at once with a single save."""
+    store = InMemoryVectorStore(pickle_path=temp_pickle_path)
+    store.add(np.array([1.0, 1.0, 0.0]), {"id": 0})
+    store.search(np.array([1.0, 1.0, 0.0]))
+
+    vectors = np.array([[3.0, 0.0, 0.0], [0.0, 2.0, 0.0], [0.0, 0.0, 5.0]])
+    store.add_many(vectors, [{"id": 1}, {"id": 2}, {"id": 3}])
+
+    assert store.size == 4
+    assert np.allclose(np.linalg.norm(store.embeddings, axis=1), 1.0)
+    results = store.search(np.array([0.0, 1.0, 0.0]), top_k=1)
+    assert results[0][0]["id"] == 2
+
+    loaded = InMemoryVectorStore(pickle_path=temp_pickle_path)
+    assert [m["id"] for m in loaded.metadata] == [0, 1, 2, 3]
+
+
+def test_add_many_empty(temp_pickle_path):
+    """Test that adding no embeddings leaves the store unchanged."""
+    store = InMemoryVectorStore(pickle_path=temp_pickle_path)
+    store.add_many([], [])
+    assert store.size == 0
+    assert not os.path.exists(temp_pickle_path)
+
+
+def test_add_many_length_mismatch():
+    """Test that add_many rejects mismatched embeddings and metadata."""
+    store = InMemoryVectorStore()
+    with pytest.raises(ValueError):
+        store.add_many(np.ones((2, 3)), [{"id": 1}])
+
+
+def test_add_many_already_normalized():
+    """Test that pre-normalized vectors are stored as given."""
+    store = InMemoryVectorStore()
+    vectors = np.array([[0.6, 0.8, 0.0], [0.0, 0.0, 1.0]])
+    store.add_many(vectors, [{"id": 1}, {"id": 2}], normalized=True)
+    vectors[0] = 0.0
+
+    np.testing.assert_array_almost_equal(store.embeddings[0], [0.6, 0.8, 0.0])
+    assert store.embeddings.dtype == np.float32
+    with pytest.raises(ValueError):
+        store.embeddings[0, 0] = 0.0
+    results = store.search(np.array([0.6, 0.8, 0.0]), top_k=1)
+    assert results[0][0]["id"] == 1
+    assert np.isclose(results[0][1], 1.0)
+
+
+def test_int8_quantization():
+    """Test that int8-quantized search closely matches float32 search."""
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(300, 16))
+    metadata = [{"id": i} for i in range(300)]
+
+    exact = InMemoryVectorStore()
+    exact.add_many(vectors, metadata)
+    quantized = InMemoryVectorStore(quantization="int8")
+    quantized.add_many(vectors[:200], metadata[:200])
+    quantized.search(vectors[0])
+    quantized.add_many(vectors[200:], metadata[200:])
+
+    for query in (vectors[7], vectors[250]):
+        exact_results = exact.search(query, top_k=3)
+        quantized_results = quantized.search(query, top_k=3)
+        assert quantized_results[0][0] == exact_results[0][0]
+        np.testing.assert_allclose(
+            [score for _, score in quantized_results],
+            [score for _, score in exact_results],
+            atol=1e-2,
+        )
+
+
+def test_unsupported_quantization():
+    """Test that unknown quantization modes are rejected."""
+    with pytest.raises(ValueError):
+        InMemoryVectorStore(quantization="int4")
+
+
+def test_hnsw_index(temp_pickle_path, monkeypatch):
+    """Test that large stores are searched through a persisted HNSW index."""
+    pytest.importorskip("faiss")
+    monkeypatch.setattr("code_rag_server.vector_store._HNSW_MIN_SIZE", 100)
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(150, 16))
+    metadata = [{"id": i} for i in range(150)]
+
+    store = InMemoryVectorStore(pickle_path=temp_pickle_path)
+    store.add_many(vectors[:50], metadata[:50])
+    assert not os.path.exists(store.ann_index_path)
+    store.add_many(vectors[50:], metadata[50:])
+    assert os.path.exists(store.ann_index_path)
+
+    loaded = InMemoryVectorStore(pickle_path=temp_pickle_path)
+    results = loaded.search(vectors[120], top_k=3)
+    assert results[0][0]["id"] == 120
+    assert np.isclose(results[0][1], 1.0, atol=1e-5)
+
+    # Vectors not yet in the index are scanned and merged with its results
+    loaded.add(rng.normal(size=16), {"id": "saved"})
+    assert loaded._ann_index.ntotal == 151
+    loaded.pickle_path = None
+    query = rng.normal(size=16)
+    loaded.add(query, {"id": "unsaved"})
+    assert loaded._ann_index.ntotal == 151
+    assert loaded.search(query, top_k=3)[0][0]["id"] == "unsaved"
+    assert loaded.search(vectors[30], top_k=3)[0][0]["id"] == 30
+
+    loaded.pickle_path = temp_pickle_path
+    loaded.clear()
+    assert not os.path.exists(store.ann_index_path)
+
+
+def test_partitioned_search(monkeypatch):
+    """Test that large stores are searched through k-means partitions."""
+    monkeypatch.setattr("code_rag_server.vector_store._IVF_MIN_SIZE", 200)
+    monkeypatch.setattr("code_rag_server.vector_store._IVF_NPROBE", 3)
+    rng = np.random.default_rng(3)
+    centers = rng.normal(size=(10, 16))
+    vectors = centers[rng.integers(0, 10, 400)] + rng.normal(size=(400, 16)) * 0.1
+
+    store = InMemoryVectorStore()
+    store.add_many(vectors[:300], [{"id": i} for i in range(300)])
+    assert store.search(vectors[42], top_k=1)[0][0]["id"] == 42
+    partitions = store._partitions
+    assert partitions.size == 300
+    assert sorted(partitions.rows) == list(range(300))
+
+    # Rows added after partitioning are scanned until the next rebuild
+    store.add_many(vectors[300:400], [{"id": i} for i in range(300, 400)])
+    assert store.search(vectors[350], top_k=1)[0][0]["id"] == 350
+    assert store._partitions is partitions
+    store.add_many(vectors[:60], [{"id": -1}] * 60)
+    store.search(vectors[0])
+    assert store._partitions.size == 460
+
+
+def test_partitioned_search_nprobe(monkeypatch):
+    """Test that nprobe sets how many partitions a search scans."""
+    monkeypatch.setattr("code_rag_server.vector_store._IVF_MIN_SIZE", 200)
+    rng = np.random.default_rng(6)
+    vectors = rng.normal(size=(400, 16))
+
+    store = InMemoryVectorStore(nprobe=1000)
+    store.add_many(vectors, [{"id": i} for i in range(400)])
+    # Probing every partition scans every vector
+    assert len(store.search(vectors[0], top_k=400)) == 400
+    assert store._partitions is not None
+
+    store.nprobe = 1
+    assert len(store.search(vectors[0], top_k=400)) < 400
+
+    with pytest.raises(ValueError):
+        InMemoryVectorStore(nprobe=0)
+
+
+def test_partitions_persisted(temp_pickle_path, monkeypatch):
+    """Test that partitions are built on save and loaded with the store."""
+    monkeypatch.setattr("code_rag_server.vector_store.faiss", None)
+    monkeypatch.setattr("code_rag_server.vector_store._IVF_MIN_SIZE", 200)
+    rng = np.random.default_rng(4)
+    vectors = rng.normal(size=(300, 16))
+
+    store = InMemoryVectorStore(pickle_path=temp_pickle_path)
+    store.add_many(vectors, [{"id": i} for i in range(300)])
+    assert store._partitions.size == 300
+    assert os.path.exists(store.partitions_path)
+
+    loaded = InMemoryVectorStore(pickle_path=temp_pickle_path)
+    np.testing.assert_array_equal(
+        loaded._partitions.centroids, store._partitions.centroids
+    )
+    with patch("code_rag_server.vector_store._build_partitions") as build:
+        assert loaded.search(vectors[7], top_k=1)[0][0]["id"] == 7
+    build.assert_not_called()
+
+    loaded.clear()
+    assert not os.path.exists(store.partitions_path)
+
+
+def test_exact_search_without_approximation(temp_pickle_path, monkeypatch):
+    """Test that approximate=False scans every vector of a large store."""
+    monkeypatch.setattr("code_rag_server.vector_store.faiss", None)
+    monkeypatch.setattr("code_rag_server.vector_store._IVF_MIN_SIZE", 200)
+    rng = np.random.default_rng(5)
+    vectors = rng.normal(size=(300, 16))
+
+    store = InMemoryVectorStore(pickle_path=temp_pickle_path, approximate=False)
+    store.add_many(vectors, [{"id": i} for i in range(300)])
+    assert not os.path.exists(store.partitions_path)
+
+    results = store.search(vectors[11], top_k=300)
+    assert len(results) == 300
+    assert results[0][0]["id"] == 11
+    assert store._partitions is None
+
+
+def test_compressed_metadata(temp_pickle_path, sample_metadata, monkeypatch):
+    """Test that metadata is compressed with zstandard when it is installed."""
+    pytest.importorskip("zstandard")
+    store = InMemoryVectorStore(pickle_path=temp_pickle_path)
+    store.add(np.array([1.0, 0.0]), sample_metadata)
+
+    with open(temp_pickle_path, "rb") as f:
+        assert f.read(4) == b"\x28\xb5\x2f\xfd"
+    assert InMemoryVectorStore(pickle_path=temp_pickle_path).metadata == [
+        sample_metadata
+    ]
+
+    monkeypatch.setattr("code_rag_server.vector_store.zstandard", None)
+    with pytest.raises(ValueError, match="install zstandard"):
+        InMemoryVectorStore(pickle_path=temp_pickle_path)
+
+    # Without zstandard the metadata is pickled uncompressed
+    store.save()
+    with open(temp_pickle_path, "rb") as f:
+        assert pickle.load(f) == [sample_metadata]